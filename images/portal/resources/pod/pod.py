@@ -14,10 +14,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import compileall
 import logging
+import time
+import toolset
 
 from ochopod.bindings.ec2.marathon import Pod
 from ochopod.models.piped import Actor as Piped
+from os.path import dirname
+from requests import get
 
 logger = logging.getLogger('ochopod')
 
@@ -26,10 +31,31 @@ if __name__ == '__main__':
 
     class Strategy(Piped):
 
+        checks = 3
+
         cwd = '/opt/portal'
-        
+
+        def initialize(self):
+
+            #
+            # - byte-compile the toolset upfront
+            # - each tool runs in its own interpreter and would otherwise re-compile its command module
+            #
+            ts = time.time()
+            compileall.compile_dir(dirname(toolset.__file__), quiet=1)
+            logger.debug('warm-up -> toolset compiled (%d ms)' % int(1000 * (time.time() - ts)))
+
         def configure(self, _):
 
             return 'python portal.py', {}
 
+        def sanity_check(self, _):
+
+            #
+            # - report the portal readiness & warm-up timings as part of our status
+            # - the portal returns a HTTP 503 until its warm-up is over
+            #
+            reply = get('http://localhost:9000/ready', timeout=5.0)
+            return reply.json()
+
     Pod().boot(Strategy)
\ No newline at end of file
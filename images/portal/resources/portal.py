@@ -29,11 +29,25 @@ from ochopod.core.fsm import diagnostic, spin_lock
 from ochopod.core.utils import shell
 from os.path import join
 from subprocess import Popen, PIPE
+from threading import Event, Thread
+from toolset.autoscaler import Autoscaler
+from toolset.collector import Collector
+from toolset.marathon import client
+from toolset.registry import Registry
 
 
 logger = logging.getLogger('ochopod')
 web = Flask(__name__)
 
+#: Where the pod registry snapshot is persisted (dcos.json mounts a host volume there so that it survives a restart).
+SNAPSHOT = '/var/lib/portal/registry.bin'
+
+#: Where the log collector keeps its ring buffers.
+LOGS = '/opt/portal/logs'
+
+#: Maximum time in seconds a shell request will wait for the portal to be warmed up.
+WARMUP_TIMEOUT = 60.0
+
 
 if __name__ == '__main__':
 
@@ -49,8 +63,163 @@ if __name__ == '__main__':
         ochopod.enable_cli_log(debug=hints['debug'] == 'true')
         env['OCHOPOD_ZK'] = hints['zk']
 
+        #
+        # - start persisting the pod registry to disk
+        # - any snapshot left from a previous run is served straight away
+        # - the tools will use it via $OCHOPOD_SNAPSHOT (e.g ls --fast) but only while the registry is stale (e.g
+        #   until the first reconciliation or whenever zookeeper is unreachable), otherwise they go live
+        #
+        registry = Registry(hints['zk'].split(','), SNAPSHOT, period=float(env.get('OCHOPOD_SNAPSHOT_PERIOD', 30)))
+
+        def _env(stale):
+            return dict(env, OCHOPOD_SNAPSHOT=SNAPSHOT) if stale else env
+
+        #
+        # - optionally run the autoscaler (set $OCHOPOD_AUTOSCALE to 'on' or 'dry-run')
+        # - it will only resize the clusters whose definition declared scaling rules
+        #
+        mode = env.get('OCHOPOD_AUTOSCALE', 'off')
+        autoscaler = None
+        if mode in ('on', 'dry-run'):
+            period = float(env.get('OCHOPOD_AUTOSCALE_PERIOD', 30))
+            autoscaler = Autoscaler(hints['zk'].split(','), period=period, dry=mode == 'dry-run')
+            logger.info('autoscaler enabled (%s, every %d s)' % (mode, period))
+
+        #
+        # - optionally collect & index the pod logs (set $OCHOPOD_COLLECT to 'on')
+        # - the tools will query it via $OCHOPOD_COLLECTOR (e.g log --search)
+        #
+        collector = None
+        if env.get('OCHOPOD_COLLECT', 'off') == 'on':
+            size = 1048576 * int(env.get('OCHOPOD_COLLECT_MB', 16))
+            postings = int(env.get('OCHOPOD_COLLECT_POSTINGS', 1048576))
+            collector = Collector(hints['zk'].split(','), LOGS, size=size, period=float(env.get('OCHOPOD_COLLECT_PERIOD', 10)), postings=postings)
+            env['OCHOPOD_COLLECTOR'] = 'http://localhost:9000'
+            logger.info('log collector enabled (%d MB per cluster)' % (size / 1048576))
+
+        ready = Event()
+        timings = {}
+
+        def _leader():
+
+            #
+            # - look the marathon leader up using the client shared with the autoscaler
+            # - pass it down to the tools via $MARATHON_LEADER (this saves a /v2/leader round-trip for each of them)
+            #
+            leader = client().discover()
+            if leader:
+                env['MARATHON_LEADER'] = leader
+            else:
+                env.pop('MARATHON_LEADER', None)
+            return leader
+
+        def _refresh(period):
+
+            #
+            # - the leader may change at any time (a former leader would then just proxy our requests)
+            # - look it up again periodically
+            #
+            while 1:
+                time.sleep(period)
+                try:
+                    _leader()
+
+                except Exception as failure:
+
+                    logger.warning('marathon leader lookup failed -> %s' % diagnostic(failure))
+
+        def _warmup():
+
+            try:
+
+                #
+                # - run the toolset once to load every tool (the .py files are then in the page cache and
+                #   byte-compiled)
+                #
+                ts = time.time()
+                code, _ = shell('toolset help', env=env)
+                timings['tools'] = int(1000 * (time.time() - ts))
+                logger.debug('warm-up -> tools loaded (%d ms)' % timings['tools'])
+
+                #
+                # - look the marathon leader up and keep refreshing it in the background
+                #
+                if 'MARATHON_MASTER' in env:
+                    ts = time.time()
+                    leader = _leader()
+                    timings['marathon'] = int(1000 * (time.time() - ts))
+                    logger.debug('warm-up -> marathon leader @ %s (%d ms)' % (leader, timings['marathon']))
+
+                    refresh = Thread(target=_refresh, args=(float(env.get('MARATHON_LEADER_PERIOD', 30)),))
+                    refresh.daemon = True
+                    refresh.start()
+
+                #
+                # - if we inherited a snapshot we are ready right away (the tools will be handed the snapshot until
+                #   the registry is reconciled)
+                # - otherwise wait for the registry to be reconciled with zookeeper (connection + first full scan)
+                # - don't wait forever, the tools will go to zookeeper directly anyway
+                #
+                if not os.path.exists(SNAPSHOT):
+                    ts = time.time()
+                    registry.reconciled.wait(WARMUP_TIMEOUT)
+                    timings['zookeeper'] = int(1000 * (time.time() - ts))
+
+                logger.debug('warm-up -> %d pods in the registry (%s)' % (registry.pods, 'stale' if registry.stale else 'live'))
+
+            except Exception as failure:
+
+                logger.warning('warm-up failed -> %s' % diagnostic(failure))
+
+            finally:
+
+                ready.set()
+
+        warmup = Thread(target=_warmup)
+        warmup.daemon = True
+        warmup.start()
+
+        @web.route('/ready', methods=['GET'])
+        def _ready():
+
+            #
+            # - HTTP 200 once the warm-up is over, HTTP 503 otherwise
+            # - this can be used as a marathon health-check
+            #
+            js = {'ready': ready.is_set(), 'stale': registry.stale, 'ms': timings}
+            return json.dumps(js), 200 if ready.is_set() else 503
+
+        @web.route('/autoscaler', methods=['GET'])
+        def _autoscaler():
+
+            #
+            # - return the most recent autoscaler decisions (HTTP 404 if it is not enabled)
+            #
+            if not autoscaler:
+                return json.dumps({'mode': mode}), 404
+
+            return json.dumps({'mode': mode, 'decisions': list(autoscaler.decisions)}), 200
+
+        @web.route('/log/search', methods=['GET'])
+        def _search():
+
+            #
+            # - look the collected log lines up (HTTP 404 if the collector is not enabled)
+            #
+            if not collector:
+                return json.dumps({'ok': False}), 404
+
+            ts = time.time()
+            query = request.args.get('q', '', type=str)
+            clusters = request.args.get('clusters', '*', type=str)
+            limit = request.args.get('limit', 0, type=int)
+            hits = collector.search(query, clusters, limit)
+            ms = 1000 * (time.time() - ts)
+            return json.dumps({'ok': True, 'ms': int(ms), 'hits': hits}), 200
+
         @web.route('/shell', methods=['POST'])
         def _from_curl():
+            ready.wait(WARMUP_TIMEOUT)
             tmp = tempfile.mkdtemp()
             try:
 
@@ -70,15 +239,17 @@ if __name__ == '__main__':
                 ts = time.time()
                 line = request.headers['X-Shell']
                 logger.debug('http -> shell request "%s"' % line)
-                pid = Popen('toolset %s' % line, shell=True, stdout=PIPE, stderr=PIPE, env=env, cwd=tmp)
+                stale = registry.stale
+                pid = Popen('toolset %s' % line, shell=True, stdout=PIPE, stderr=PIPE, env=_env(stale), cwd=tmp)
 
                 #
                 # - wait for completion
                 # - return as json ('out' contains the verbatim dump from the sub-process stdout)
+                # - 'stale' is set if the tool was handed the registry snapshot (e.g it was not reconciled yet)
                 #
                 pid.wait()
                 ms = 1000 * (time.time() - ts)
-                return json.dumps({'ok': pid.returncode == 0, 'ms': int(ms), 'out': pid.stdout.read()})
+                return json.dumps({'ok': pid.returncode == 0, 'ms': int(ms), 'out': pid.stdout.read(), 'stale': stale})
 
             except Exception as failure:
 
@@ -95,6 +266,7 @@ if __name__ == '__main__':
 
         @web.route('/shell', methods=['GET'])
         def _from_web_shell():
+            ready.wait(WARMUP_TIMEOUT)
             tmp = tempfile.mkdtemp()
             try:
 
@@ -106,15 +278,17 @@ if __name__ == '__main__':
                 ts = time.time()
                 line = request.args.get('line', 0, type=str)
                 logger.debug('http -> shell request "%s"' % line)
-                pid = Popen('toolset %s' % line, shell=True, stdout=PIPE, stderr=PIPE, env=env, cwd=tmp)
+                stale = registry.stale
+                pid = Popen('toolset %s' % line, shell=True, stdout=PIPE, stderr=PIPE, env=_env(stale), cwd=tmp)
 
                 #
                 # - wait for completion
                 # - return as json ('out' contains the verbatim dump from the sub-process stdout)
+                # - 'stale' is set if the tool was handed the registry snapshot (e.g it was not reconciled yet)
                 #
                 pid.wait()
                 ms = 1000 * (time.time() - ts)
-                return json.dumps({'ok': pid.returncode == 0, 'ms': int(ms), 'out': pid.stdout.read()})
+                return json.dumps({'ok': pid.returncode == 0, 'ms': int(ms), 'out': pid.stdout.read(), 'stale': stale})
 
             except Exception as failure:
 
@@ -0,0 +1,114 @@
+#
+# Copyright (c) 2015 Autodesk Inc.
+# All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Rough memory benchmark for the pod registry as returned by toolset.io.lookup(). A fake zookeeper client is used to
+feed synthetic pod registrations (no ensemble required). Run it from within the portal container, e.g:
+
+    $ python benchmarks/registry.py 10000
+
+The footprint is reported per 10,000 pods, both for the compact pod records and for the plain dicts we used to build.
+"""
+import json
+import sys
+
+from ochopod.core.core import ROOT
+from toolset.io import lookup
+
+
+class _ZK():
+    """
+    Minimal stand-in for a kazoo client exposing the registry layout lookup() walks through.
+    """
+
+    def __init__(self, clusters, pods):
+
+        self.registry = {}
+        for n in range(clusters):
+            cluster = 'marathon.cluster-%d' % n
+            self.registry[cluster] = {}
+            for seq in range(pods // clusters):
+                hints = \
+                    {
+                        'application': 'ochopod.%s-2015-06-01-00-00-00' % cluster,
+                        'ip': '10.0.%d.%d' % (seq // 256, seq % 256),
+                        'public': '54.0.%d.%d' % (seq // 256, seq % 256),
+                        'node': 'i-%08x' % seq,
+                        'namespace': 'marathon',
+                        'port': '8080',
+                        'ports': {'8080': 31000 + seq % 1000, '9000': 32000 + seq % 1000},
+                        'seq': seq,
+                        'task': 'ochopod.%s.%08x' % (cluster, seq),
+                        'zk': '10.0.0.1:2181'
+                    }
+                self.registry[cluster]['%08x' % seq] = json.dumps(hints)
+
+    def get_children(self, path):
+
+        tokens = path[len(ROOT) + 1:].split('/')
+        return self.registry.keys() if not tokens[0] else self.registry[tokens[0]].keys()
+
+    def get(self, path):
+
+        tokens = path[len(ROOT) + 1:].split('/')
+        return self.registry[tokens[0]][tokens[2]], None
+
+
+def _footprint(obj, seen=None):
+
+    #
+    # - walk the object graph and sum up the shallow sizes
+    # - shared objects (e.g interned cluster strings) are only counted once
+    #
+    if seen is None:
+        seen = set()
+
+    if id(obj) in seen:
+        return 0
+
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_footprint(key, seen) + _footprint(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_footprint(item, seen) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(_footprint(getattr(obj, slot), seen) for slot in obj.__slots__ if hasattr(obj, slot))
+
+    return size
+
+
+if __name__ == '__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    zk = _ZK(max(1, n // 100), n)
+    pods = lookup(zk, '*')
+    scale = 10000.0 / len(pods)
+
+    #
+    # - compare against the plain dicts we used to build (e.g decoded hints keyed by '<cluster> #<seq>')
+    # - also measure the records once all their hints have been decoded (which is what fire() does)
+    #
+    plain = {key: dict(pod.items()) for key, pod in lookup(zk, '*').items()}
+    compact = _footprint(pods)
+    for pod in pods.values():
+        pod.hints
+
+    decoded = _footprint(pods)
+    print('%d pods' % len(pods))
+    print('compact pod records : %.1f MB / 10,000 pods' % (scale * compact / 1048576.0))
+    print('decoded pod records : %.1f MB / 10,000 pods' % (scale * decoded / 1048576.0))
+    print('plain dicts         : %.1f MB / 10,000 pods' % (scale * _footprint(plain) / 1048576.0))
@@ -0,0 +1,200 @@
+#
+# Copyright (c) 2015 Autodesk Inc.
+# All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import logging
+import time
+
+from collections import deque
+from ochopod.core.fsm import diagnostic, shutdown
+from threading import Event, Thread
+from toolset.commands.scale import scale
+from toolset.io import field, fire, run, ZK
+from toolset.marathon import client
+
+#: Our ochopod logger.
+logger = logging.getLogger('ochopod')
+
+
+class Autoscaler(Thread):
+    """
+    Background thread run by the portal and periodically evaluating the scaling rules declared in the container
+    definitions (see the 'autoscale' setting, stored by deploy as a marathon label). Each cluster is sampled via a
+    control/signal fan-out and resized in place (see scale()) once its metric stayed outside of the [low, high] band
+    for a few samples in a row and its cooldown elapsed. Every decision is logged and the most recent ones are kept
+    around. In dry-run mode nothing is actually resized.
+    """
+
+    def __init__(self, brokers, period=30.0, dry=False, timeout=60):
+        super(Autoscaler, self).__init__()
+
+        self.brokers = brokers
+        self.daemon = True
+        self.decisions = deque(maxlen=256)
+        self.dry = dry
+        self.last = {}
+        self.period = period
+        self.stopped = Event()
+        self.streaks = {}
+        self.timeout = timeout
+
+        self.start()
+
+    def run(self):
+
+        proxy = ZK.start(self.brokers)
+        try:
+
+            while not self.stopped.is_set():
+                try:
+
+                    self._tick(proxy)
+
+                except Exception as failure:
+
+                    logger.warning('autoscaler : evaluation failed (%s)' % diagnostic(failure))
+
+                self.stopped.wait(self.period)
+
+        finally:
+
+            shutdown(proxy)
+
+    def _tick(self, proxy):
+
+        #
+        # - lookup the marathon applications carrying scaling rules
+        # - the identifiers are timestamped : the most recent application of a given cluster wins
+        # - standby pools carry the same labels and are skipped
+        # - clusters with a marathon deployment in progress are left alone
+        #
+        reply = client().get('/v2/apps', params={'label': 'ochopod_autoscale', 'embed': 'apps.deployments'})
+        code = reply.status_code
+        assert code == 200, 'application lookup failed (HTTP %d)' % code
+        rules = {}
+        busy = set()
+        for js in sorted(reply.json()['apps'], key=lambda js: js['id'].split('/')[-1]):
+            labels = js.get('labels', {})
+            if 'ochopod_standby' in labels:
+                continue
+
+            env = js.get('env', {})
+            cluster = '%s.%s' % (env['ochopod_namespace'], env['ochopod_cluster'])
+            rules[cluster] = json.loads(labels['ochopod_autoscale'])
+            if js.get('deployments'):
+                busy.add(cluster)
+
+        #
+        # - a rule sampling a metric must define its [low, high] band
+        # - any failure is specific to one cluster : log it and move on to the next one
+        #
+        for cluster, rule in sorted(rules.items()):
+            try:
+                if cluster in busy:
+                    self._log(cluster, 'hold', 'deployment in progress')
+                elif 'metric' in rule and not ('low' in rule and 'high' in rule):
+                    self._log(cluster, 'hold', 'invalid rule (metric set without low & high)')
+                else:
+                    self._evaluate(proxy, cluster, rule)
+
+            except Exception as failure:
+
+                self._log(cluster, 'error', diagnostic(failure))
+
+    def _evaluate(self, proxy, cluster, rule):
+
+        #
+        # - count the pods that are currently alive (idle standby pods are skipped by fire())
+        # - sample the metric on those via their signal() callback
+        #
+        payload = json.dumps(rule.get('signal', {}))
+
+        def _sample(zk):
+            replies = fire(zk, cluster, 'info')
+            alive = [seq for seq, hints, code in replies.values() if code == 200 and hints['process'] != 'dead']
+            if not alive or 'metric' not in rule:
+                return alive, []
+
+            values = []
+            for _, js, code in fire(zk, cluster, 'control/signal', subset=alive, js=payload).values():
+                try:
+                    if code == 200:
+                        values.append(float(field(js, rule['metric'])))
+
+                except (KeyError, TypeError, ValueError):
+                    pass
+
+            return alive, values
+
+        alive, values = run(proxy, _sample)
+        n = len(alive)
+        if not n:
+            self._log(cluster, 'hold', 'no pods alive')
+            return
+
+        lo = rule.get('min', 1)
+        hi = rule.get('max', max(n, lo))
+        avg = sum(values) / len(values) if values else None
+
+        #
+        # - the min/max bounds are enforced right away
+        # - otherwise the metric must stay above 'high' (or below 'low') for 'samples' evaluations in a row
+        # - the [low, high] band plus the streak give us our hysteresis
+        #
+        if n < lo:
+            target, why = lo, 'below min (%d pods)' % n
+        elif n > hi:
+            target, why = hi, 'above max (%d pods)' % n
+        elif avg is None:
+            self.streaks.pop(cluster, None)
+            self._log(cluster, 'hold', '%d pods, no metric' % n)
+            return
+        else:
+            direction = 1 if avg > rule['high'] else -1 if avg < rule['low'] else 0
+            previous, count = self.streaks.get(cluster, (0, 0))
+            count = count + 1 if direction and direction == previous else 1
+            self.streaks[cluster] = (direction, count)
+            why = '%d pods, %s=%.2f (%d/%d)' % (n, rule['metric'], avg, count, rule.get('samples', 3))
+            if not direction or count < rule.get('samples', 3):
+                self._log(cluster, 'hold', why)
+                return
+
+            target = min(hi, max(lo, n + direction * rule.get('step', 1)))
+            if target == n:
+                self._log(cluster, 'hold', why)
+                return
+
+        #
+        # - honor the cooldown period since the last time we resized that cluster
+        #
+        left = self.last.get(cluster, 0) + rule.get('cooldown', 300) - time.time()
+        if left > 0:
+            self._log(cluster, 'cooldown', '%s, %d s left' % (why, left))
+            return
+
+        self.last[cluster] = time.time()
+        self.streaks.pop(cluster, None)
+        if self.dry:
+            self._log(cluster, 'scale', '%s -> %d pods (dry-run)' % (why, target))
+            return
+
+        js = scale(proxy, [cluster], target, self.timeout)[cluster]
+        self._log(cluster, 'scale', '%s -> %d pods (%s)' % (why, target, 'ok' if js['ok'] else 'failed'))
+
+    def _log(self, cluster, action, why):
+
+        self.decisions.append({'cluster': cluster, 'action': action, 'why': why, 'time': int(time.time())})
+        logger.info('autoscaler : %s -> %s, %s' % (cluster, action, why))
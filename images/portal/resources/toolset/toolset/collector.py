@@ -0,0 +1,239 @@
+#
+# Copyright (c) 2015 Autodesk Inc.
+# All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import fnmatch
+import json
+import logging
+import os
+import re
+import shutil
+
+from collections import defaultdict, deque
+from ochopod.core.fsm import diagnostic, shutdown
+from threading import Event, Lock, Thread
+from toolset.commands.log import unpack
+from toolset.io import members, run, stream, ZK
+
+#: Our ochopod logger.
+logger = logging.getLogger('ochopod')
+
+#: What we index (case insensitive alphanumeric tokens).
+_TOKEN = re.compile(r'\w+')
+
+
+class _Ring(object):
+    """
+    Size-bounded on-disk ring buffer holding the log lines of one cluster. It is made of append-only segments, the
+    oldest one being dropped whenever we go over the limit. An inverted index maps each token to the location
+    (segment, offset) of the lines featuring it. Each segment is also capped in number of postings so that the
+    in-memory index stays bounded along with the disk usage.
+    """
+
+    def __init__(self, path, size, postings=1048576, segments=8):
+
+        self.cap = max(1, postings // segments)
+        self.counts = deque([0])
+        self.index = defaultdict(deque)
+        self.limit = max(1, size // segments)
+        self.lock = Lock()
+        self.path = path
+        self.segments = deque([0])
+        self.size = size
+        self.written = 0
+
+        #
+        # - the index is only kept in memory : start from a clean slate
+        #
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+    def _where(self, segment):
+        return os.path.join(self.path, '%d.log' % segment)
+
+    def _roll(self):
+
+        #
+        # - open a new segment and drop the oldest ones if we went over the limit
+        # - purge the index accordingly (postings are ordered by segment)
+        #
+        self.segments.append(self.segments[-1] + 1)
+        self.counts.append(0)
+        self.written = 0
+        while len(self.segments) * self.limit > self.size:
+            dropped = self.segments.popleft()
+            self.counts.popleft()
+            if os.path.exists(self._where(dropped)):
+                os.remove(self._where(dropped))
+
+            for token in list(self.index.keys()):
+                postings = self.index[token]
+                while postings and postings[0][0] <= dropped:
+                    postings.popleft()
+                if not postings:
+                    del self.index[token]
+
+    def append(self, prefix, lines):
+
+        #
+        # - each line is stored on disk behind the specified prefix (e.g the pod key)
+        # - only the line itself is indexed
+        # - roll over as soon as the current segment is full, either in bytes or in postings
+        #
+        with self.lock:
+            f = open(self._where(self.segments[-1]), 'ab')
+            try:
+                for line in lines:
+                    if self.written >= self.limit or self.counts[-1] >= self.cap:
+                        f.close()
+                        self._roll()
+                        f = open(self._where(self.segments[-1]), 'ab')
+
+                    raw = ('%s | %s\n' % (prefix, line.rstrip('\n'))).encode('utf-8')
+                    f.write(raw)
+                    tokens = set(_TOKEN.findall(line.lower()))
+                    for token in tokens:
+                        self.index[token].append((self.segments[-1], self.written))
+                    self.counts[-1] += len(tokens)
+                    self.written += len(raw)
+
+            finally:
+                f.close()
+
+    def search(self, tokens, limit=None):
+
+        #
+        # - intersect the postings of each token (e.g all the tokens must be found)
+        # - read the matching lines back from disk, oldest first
+        #
+        with self.lock:
+            hits = None
+            for token in tokens:
+                found = set(self.index.get(token, ()))
+                hits = found if hits is None else hits & found
+
+            hits = sorted(hits or [])
+            if limit:
+                hits = hits[-limit:]
+
+            out = []
+            files = {}
+            try:
+                for segment, offset in hits:
+                    if segment not in files:
+                        files[segment] = open(self._where(segment), 'rb')
+                    f = files[segment]
+                    f.seek(offset)
+                    out.append(f.readline().decode('utf-8').rstrip('\n'))
+
+            finally:
+                for f in files.values():
+                    f.close()
+
+            return out
+
+
+class Collector(Thread):
+    """
+    Background thread run by the portal and periodically pulling the new log lines from every pod (using the same
+    cursors as log -f). The lines are stored per cluster in a size-bounded ring buffer on disk and indexed so that
+    searches (see search()) can be answered without contacting the pods.
+    """
+
+    def __init__(self, brokers, path, size=16777216, period=10.0, budget=262144, postings=1048576):
+        super(Collector, self).__init__()
+
+        self.brokers = brokers
+        self.budget = budget
+        self.cursors = {}
+        self.daemon = True
+        self.path = path
+        self.period = period
+        self.postings = postings
+        self.rings = {}
+        self.size = size
+        self.stopped = Event()
+
+        self.start()
+
+    def run(self):
+
+        proxy = ZK.start(self.brokers)
+        try:
+
+            while not self.stopped.is_set():
+                try:
+
+                    self._pull(proxy)
+
+                except Exception as failure:
+
+                    logger.warning('collector : pull failed (%s)' % diagnostic(failure))
+
+                self.stopped.wait(self.period)
+
+        finally:
+
+            shutdown(proxy)
+
+    def _pull(self, proxy):
+
+        #
+        # - ask each pod for what it logged since our last pull (capped to our byte budget)
+        # - tag each line with its pod key and append to the ring buffer of its cluster
+        #
+        def _request(key):
+            js = {'tail': None, 'bytes': self.budget}
+            native, cursor = self.cursors.get(key, (False, None))
+            if native:
+                js['cursor'] = cursor
+            return json.dumps(js)
+
+        def _query(zk):
+            pods = members(zk, '*')
+            return set(pods), [(key, log, code) for key, _, log, code in stream(pods, 'log', js=_request)]
+
+        #
+        # - forget the cursors of the pods that are gone (the ones that just did not reply keep theirs)
+        #
+        keys, replies = run(proxy, _query)
+        for key in set(self.cursors) - keys:
+            del self.cursors[key]
+
+        total = 0
+        for key, log, code in sorted(replies):
+            if code == 200:
+                lines, self.cursors[key] = unpack(log, self.cursors.get(key), None, None, self.budget)
+                cluster = key.split(' #')[0]
+                if cluster not in self.rings:
+                    self.rings[cluster] = _Ring(os.path.join(self.path, cluster), self.size, self.postings)
+
+                self.rings[cluster].append(key, lines)
+                total += len(lines)
+
+        logger.debug('collector : %d new lines from %d pods' % (total, len(replies)))
+
+    def search(self, query, clusters='*', limit=None):
+        """
+        Returns the most recent lines featuring all the tokens in the query, per cluster.
+        """
+
+        tokens = _TOKEN.findall(query.lower())
+        if not tokens:
+            return {}
+
+        rings = [(cluster, ring) for cluster, ring in list(self.rings.items()) if fnmatch.fnmatch(cluster, clusters)]
+        return {cluster: ring.search(tokens, limit) for cluster, ring in rings}
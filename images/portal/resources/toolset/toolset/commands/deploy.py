@@ -15,6 +15,8 @@
 # limitations under the License.
 #
 import datetime
+import fnmatch
+import hashlib
 import json
 import logging
 import os
@@ -22,11 +24,14 @@ import time
 import yaml
 
 from ochopod.core.fsm import diagnostic
-from ochopod.core.utils import merge, retry, shell
-from random import choice
-from requests import delete, post
-from threading import Thread
-from toolset.io import fire, run
+from ochopod.core.utils import merge, retry
+from threading import Event, Lock, Thread
+from toolset.commands.kill import kill
+from toolset.commands.scale import scale
+from toolset.io import fire, pooled, run
+from toolset.marathon import client
+from toolset.readiness import spin
+from toolset.standby import claim, newest, pool, prune, refill, retire
 from toolset.tool import Template
 from yaml import YAMLError
 
@@ -34,12 +39,61 @@ from yaml import YAMLError
 logger = logging.getLogger('ochopod')
 
 
+class _Batch():
+    """
+    Collects the application specs compiled by each _Automation thread and submits them all at once as a single
+    marathon group (e.g one deployment plan instead of one per container definition). Each thread must check in
+    exactly once, either with its spec or with None if it failed before getting there.
+    """
+
+    def __init__(self, namespace, n):
+
+        self.done = Event()
+        self.lock = Lock()
+        self.n = n
+        self.ok = False
+        self.specs = []
+        self.stamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d-%H-%M-%S')
+        self.group = 'ochopod.%s-%s' % (namespace, self.stamp)
+
+    def submit(self, spec):
+
+        with self.lock:
+
+            self.n -= 1
+            if spec:
+                self.specs.append(spec)
+
+            if not self.n:
+                try:
+
+                    #
+                    # - we're the last thread checking in
+                    # - fire one POST /v2/groups with all our applications
+                    #
+                    if self.specs:
+                        reply = client().post('/v2/groups', js={'id': '/%s' % self.group, 'apps': self.specs})
+                        code = reply.status_code
+                        self.ok = code == 200 or code == 201
+                        logger.debug('%s : %d applications submitted (HTTP %d)' % (self.group, len(self.specs), code))
+
+                finally:
+                    self.done.set()
+
+        self.done.wait()
+        return self.ok
+
+
 class _Automation(Thread):
 
-    def __init__(self, proxy, template, overrides, namespace, pods, cycle, suffix, timeout, strict):
+    def __init__(self, proxy, template, overrides, namespace, pods, cycle, suffix, timeout, strict, batch=None, after=None, external=None, rolling=None, force=False, immutable=None):
         super(_Automation, self).__init__()
 
+        self.after = after or {}
+        self.batch = batch
         self.cycle = cycle
+        self.elapsed = 0.0
+        self.external = external or []
         self.namespace = namespace
         self.out = \
             {
@@ -50,27 +104,28 @@ class _Automation(Thread):
         self.overrides = overrides
         self.pods = pods
         self.proxy = proxy
+        self.rolling = rolling
         self.template = template
         self.suffix = suffix
         self.strict = strict
+        self.force = force
+        self.immutable = immutable or []
         self.timeout = max(timeout, 5)
 
         self.start()
 
     def run(self):
+
+        pending = self.batch is not None
         try:
 
             #
-            # - we need to pass the framework master IPs around (ugly)
+            # - if we depend on other clusters being deployed wait for them first
             #
-            assert 'MARATHON_MASTER' in os.environ, '$MARATHON_MASTER not specified (check your portal pod)'
-            master = choice(os.environ['MARATHON_MASTER'].split(','))
-            headers = \
-                {
-                    'content-type': 'application/json',
-                    'accept': 'application/json'
-                }
+            self._wait_for_dependencies()
 
+            ts = time.time()
+            marathon = client()
             with open(self.template, 'r') as f:
 
                 #
@@ -88,6 +143,7 @@ class _Automation(Thread):
                     {
                         'start': True,
                         'debug': False,
+                        'standby': 0,
                         'settings': {},
                         'ports': [8080],
                         'verbatim': {}
@@ -107,10 +163,14 @@ class _Automation(Thread):
                 # - timestamp the application (we really want a new uniquely identified application)
                 # - lookup the optional overrides and merge with our pod settings if specified
                 # - this is what happens when the -o option is used
+                # - in batch mode the application is nested under the marathon group
                 #
-                stamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d-%H-%M-%S')
+                stamp = self.batch.stamp if self.batch else datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d-%H-%M-%S')
                 qualified = '%s.%s' % (self.namespace, cfg['cluster'])
                 application = 'ochopod.%s-%s' % (qualified, stamp)
+                if self.batch:
+                    application = '%s/%s' % (self.batch.group, application)
+
                 if qualified in self.overrides:
 
                     blk = self.overrides[qualified]
@@ -140,13 +200,27 @@ class _Automation(Thread):
                 # - get their sequence indices (we'll use it to phase out them out)
                 # - if the target # of pods we want is not specified default to 1 unless we are cycling
                 # - set it to the current # of pods in that case
+                # - keep track of the marathon application(s) these pods belong to as well
+                # - idle standby pods are skipped by fire() (claimed ones are part of the cluster but not of its
+                #   generations)
                 #
                 def _query(zk):
                     replies = fire(zk, qualified, 'info')
-                    return [(hints['process'], seq) for _, (seq, hints, code) in replies.items() if code == 200]
+                    js = [(seq, hints) for _, (seq, hints, code) in replies.items() if code == 200]
+                    return [(hints['process'], seq) for seq, hints in js], set(hints['application'] for _, hints in js if hints['process'] != 'dead' and not pooled(qualified, hints['application']))
+
+                prev, generations = run(self.proxy, _query)
 
-                prev = run(self.proxy, _query)
-                if self.cycle and not self.pods:
+                #
+                # - if all our pods were claimed from a standby pool our current application runs no pod
+                # - look it up in marathon in that case
+                #
+                if not generations and any(state != 'dead' for state, _ in prev):
+                    latest = newest(marathon, qualified)
+                    generations = set([latest]) if latest else set()
+
+                requested = self.pods
+                if (self.cycle or self.rolling) and not self.pods:
                     self.pods = sum(1 if state != 'dead' else 0 for state, _ in prev)
 
                 #
@@ -181,6 +255,13 @@ class _Automation(Thread):
                 # - make sure to mount /etc/mesos and /opt/mesosphere to account for various mesos installs
                 #
                 ports = [_parse_port(token) for token in cfg['ports']] if 'ports' in cfg else []
+
+                #
+                # - only force the image pull if the image reference is mutable (e.g :latest)
+                # - this can be overridden in the definition by setting 'pull' to either 'always' or 'missing'
+                #
+                pull = cfg['pull'] == 'always' if 'pull' in cfg else not _immutable(cfg['image'], self.immutable)
+                self.out['image'] = cfg['image']
                 spec = \
                     {
                         'id': application,
@@ -191,14 +272,14 @@ class _Automation(Thread):
                                 'ochopod_debug': str(cfg['debug']).lower(),
                                 'ochopod_start': str(cfg['start']).lower(),
                                 'ochopod_namespace': self.namespace,
-                                'pod': json.dumps(cfg['settings'])
+                                'pod': json.dumps(cfg['settings'], sort_keys=True)
                             },
                         'container':
                             {
                                 'type': 'DOCKER',
                                 'docker':
                                     {
-                                        'forcePullImage': True,
+                                        'forcePullImage': pull,
                                         'image': cfg['image'],
                                         'network': 'BRIDGE',
                                         'portMappings': ports
@@ -226,40 +307,141 @@ class _Automation(Thread):
                     spec = merge(cfg['verbatim'], spec)
 
                 #
-                # - pick a marathon master at random
+                # - in batch mode our dependencies are part of the same marathon group
+                # - marathon will then deploy them first
+                #
+                if self.batch and self.after:
+                    clusters = ['%s-%s' % (cluster, self.suffix) if self.suffix else cluster for cluster in self.after]
+                    spec['dependencies'] = ['/%s/ochopod.%s.%s-%s' % (self.batch.group, self.namespace, cluster, stamp) for cluster in clusters]
+
+                #
+                # - if we have scaling rules store them as a marathon label (the portal autoscaler will pick them up)
+                #
+                if 'autoscale' in cfg:
+                    spec['labels'] = merge(spec.get('labels', {}), {'ochopod_autoscale': json.dumps(cfg['autoscale'], sort_keys=True)})
+
+                #
+                # - compute a digest over the canonical spec (minus what changes from one deployment to the next)
+                # - store it as a marathon label
+                # - if the pods currently running all belong to an application with the same digest there is no
+                #   need to deploy anything (except maybe scaling it)
+                # - this only holds for immutable image references : a mutable one (e.g :latest) may point to a
+                #   new image since, in which case we always deploy
+                #
+                canonical = {key: value for key, value in spec.items() if key not in ('id', 'instances', 'dependencies')}
+                digest = hashlib.sha1(json.dumps(canonical, sort_keys=True)).hexdigest()
+                spec['labels'] = merge(spec.get('labels', {}), {'ochopod_digest': digest})
+
+                #
+                # - if a standby pool is requested derive its application from our spec (same definition except
+                #   for the sub-process which is not started)
+                # - its size is stored as a label (the scale tool refills it as well)
+                # - the pool is not used with --group or in rolling mode
+                #
+                standby = None
+                if cfg['standby'] and not self.batch and not self.rolling:
+                    standby = json.loads(json.dumps(spec))
+                    standby['id'] = pool(qualified, digest)
+                    standby['env']['ochopod_start'] = 'false'
+                    standby['labels']['ochopod_standby'] = str(cfg['standby'])
+
+                if not self.force and not pull and len(generations) == 1:
+                    current = self._unchanged(marathon, digest, generations.pop())
+                    if current:
+                        self._rescale(marathon, qualified, current, prev, requested, standby, cfg['standby'])
+                        return
+
+                #
+                # - turn on as many idle pods as we can from the pool matching our digest
+                # - only the remaining pods will be scheduled by marathon
+                #
+                claimed = []
+                if standby:
+                    claimed = claim(self.proxy, qualified, standby['id'], self.pods, self.timeout)
+                    spec['instances'] = self.pods - len(claimed)
+                    self.out['claimed'] = claimed
+
+                #
                 # - fire the POST /v2/apps to create our application
                 # - this will indirectly spawn our pods
+                # - it is created even if the standby pool covered all our pods (it is then what we scale up later on)
+                # - in batch mode hand our spec over and wait for the whole group to be submitted
+                # - in rolling mode we start with the first wave only
                 #
-                url = 'http://%s/v2/apps' % master
-                reply = post(url, data=json.dumps(spec), headers=headers)
-                code = reply.status_code
-                logger.debug('-> %s (HTTP %d)' % (url, code))
-                assert code == 200 or code == 201, 'submission failed (HTTP %d)' % code
+                alive = sorted(seq for state, seq in prev if state != 'dead')
+                waves = _waves(self.pods, len(alive), *self.rolling) if self.rolling and alive else []
+                if waves:
+                    spec['instances'] = waves[0][0]
+                    logger.debug('%s : rolling over %d pods in %d waves' % (self.template, len(alive), len(waves)))
+
+                if self.batch:
+                    spec['id'] = '/%s' % application
+                    pending = False
+                    assert self.batch.submit(spec), 'group submission failed'
+
+                else:
+                    reply = marathon.post('/v2/apps', js=spec)
+                    code = reply.status_code
+                    assert code == 200 or code == 201, 'submission failed (HTTP %d)' % code
 
                 #
                 # - wait for all the pods to be in the 'running' mode
                 # - the 'application' hint is set by design to the marathon application identifier
                 # - the sequence counters allocated to our new pods are returned as well
+                # - we are notified via zookeeper & the marathon event bus (e.g no polling of the whole cluster)
                 #
                 target = ['dead', 'running'] if self.strict else ['dead', 'stopped', 'running']
-                @retry(timeout=self.timeout, pause=3, default={})
-                def _spin():
-                    def _query(zk):
-                        replies = fire(zk, qualified, 'info')
-                        return [(hints['process'], seq) for seq, hints, _ in replies.values()
-                                if hints['application'] == application and hints['process'] in target]
-
-                    js = run(self.proxy, _query)
-                    assert len(js) == self.pods, 'not all pods running yet'
-                    return js
-
-                js = _spin()
-                running = sum(1 for state, _ in js if state is not 'dead')
+                if waves:
+
+                    #
+                    # - rolling mode : scale the new application up wave after wave
+                    # - each wave is gated on its new pods settling (same target as above, except a dead pod
+                    #   fails the wave)
+                    # - the oldest pods are then phased out
+                    #
+                    settled = [state for state in target if state != 'dead']
+                    js = []
+                    down = []
+                    instances = waves[0][0]
+                    for size, drop in waves:
+
+                        if size != instances:
+                            reply = marathon.put('/v2/apps/%s' % application, js={'instances': size})
+                            code = reply.status_code
+                            assert code == 200 or code == 201, 'scaling failed (HTTP %d)' % code
+                            instances = size
+
+                        if size != len(js):
+                            js = spin(self.proxy, qualified, application, size, settled, self.timeout)
+                            assert len(js) == size, 'wave failed (%d/%d pods up)' % (len(js), size)
+
+                        if drop:
+                            if self.cycle:
+                                time.sleep(self.cycle)
+
+                            self._phase_out(qualified, alive[:drop])
+                            down += alive[:drop]
+                            alive = alive[drop:]
+                            self.out['down'] = down
+
+                else:
+
+                    n = spec['instances']
+                    js = spin(self.proxy, qualified, application, n, target, self.timeout) if n else []
+                    js += [('running', seq) for seq in claimed]
+
+                running = sum(1 for state, _ in js if state != 'dead')
                 up = [seq for _, seq in js]
                 self.out['up'] = up
                 self.out['ok'] = self.pods == running
                 logger.debug('%s : %d/%d pods are running ' % (self.template, running, self.pods))
 
+                #
+                # - top the standby pool back up (marathon will boot the new idle pods in the background)
+                #
+                if standby:
+                    refill(self.proxy, marathon, qualified, standby, cfg['standby'])
+
                 if not up:
 
                     #
@@ -267,23 +449,33 @@ class _Automation(Thread):
                     #   not booting the ochopod script for instance, which happens often)
                     # - in that case fire a HTTP DELETE against the marathon application to clean it up
                     #
-                    url = 'http://%s/v2/apps/%s' % (master, application)
-                    reply = delete(url, headers=headers)
+                    reply = marathon.delete('/v2/apps/%s' % application)
                     code = reply.status_code
-                    logger.debug('-> %s (HTTP %d)' % (url, code))
                     assert code == 200 or code == 204, 'application deletion failed (HTTP %d)' % code
 
-                elif self.cycle:
+                elif self.cycle or self.rolling:
 
                     #
                     # - phase out & clean-up the pods that were previously running
-                    # - simply exec() the kill tool for this
+                    # - in rolling mode only the dead pods are left at this point
                     #
-                    time.sleep(self.cycle)
-                    down = [seq for _, seq in prev]
-                    code, _ = shell('toolset kill %s -i %s -d' % (qualified, ' '.join(['%d' % seq for seq in down])))
-                    assert code == 0, 'failed to phase out %d pods' % len(prev)
-                    self.out['down'] = down
+                    if not waves:
+                        time.sleep(self.cycle or 0)
+
+                    left = [seq for _, seq in prev if seq not in self.out['down']]
+                    if left:
+                        self._phase_out(qualified, left)
+                        self.out['down'] += left
+
+                #
+                # - delete any standby pool left over from a previous definition
+                # - delete as well the previous applications whose pods were all claimed from a pool (they run no pod)
+                #
+                if up and not self.batch and not self.rolling:
+                    retire(self.proxy, marathon, qualified, standby['id'] if standby else None)
+                    prune(marathon, qualified, application)
+
+                self.elapsed = time.time() - ts
 
         except AssertionError as failure:
 
@@ -299,12 +491,171 @@ class _Automation(Thread):
 
             logger.debug('%s : failed to deploy -> %s' % (self.template, diagnostic(failure)))
 
+        finally:
+
+            #
+            # - make sure we check in with the batch no matter what (the other threads are waiting on us)
+            #
+            if pending:
+                self.batch.submit(None)
+
+    def _unchanged(self, marathon, digest, application):
+
+        #
+        # - look the marathon application(s) labelled with that digest up
+        # - return the application definition if it matches the one currently running
+        #
+        reply = marathon.get('/v2/apps', params={'label': 'ochopod_digest==%s' % digest})
+        code = reply.status_code
+        assert code == 200, 'application lookup failed (HTTP %d)' % code
+        matching = [js for js in reply.json()['apps'] if js['id'].lstrip('/') == application]
+        return matching[0] if matching else None
+
+    def _rescale(self, marathon, qualified, current, prev, requested, standby=None, size=0):
+
+        #
+        # - the definition did not change, just resize the cluster in place if -p was specified
+        # - run the scale workflow in-process (idle standby pods are claimed first, surplus pods are phased out)
+        # - the pods claimed from the pool are part of the cluster but not of the application : count the pods
+        # - make sure the standby pool (if any) is topped up either way
+        #
+        application = current['id'].lstrip('/')
+        alive = sum(1 for state, _ in prev if state != 'dead')
+        self.out['unchanged'] = application
+        logger.debug('%s : %s is up-to-date (%d pods)' % (self.template, application, alive))
+        ok = True
+        if requested and requested != alive:
+            js = scale(self.proxy, [qualified], requested, self.timeout, self.strict)[qualified]
+            self.out['up'] = js['up']
+            self.out['down'] = js['down']
+            ok = js['ok']
+
+        if standby:
+            refill(self.proxy, marathon, qualified, standby, size)
+
+        self.out['ok'] = ok
+
+    def _phase_out(self, qualified, seqs):
+
+        #
+        # - gracefully phase out the specified pods
+        # - run the kill workflow in-process using our zookeeper proxy
+        #
+        js = kill(self.proxy, [qualified], subset=seqs, timeout=self.timeout)[qualified]
+        assert js['ok'], 'failed to phase out %d pods' % len(seqs)
+
+    def _wait_for_dependencies(self):
+
+        #
+        # - the clusters we deploy along with us are tracked by their own thread
+        # - any failure on their end is a failure for us as well
+        # - in batch mode this is left to marathon (see the 'dependencies' setting)
+        #
+        if not self.batch:
+            for cluster, thread in self.after.items():
+                assert thread.join()['ok'], 'dependency %s failed to deploy' % cluster
+
+        #
+        # - any other cluster we depend on must be already running
+        #
+        for qualified in self.external:
+
+            @retry(timeout=self.timeout, pause=3)
+            def _spin():
+                def _query(zk):
+                    replies = fire(zk, qualified, 'info')
+                    return sum(1 for _, hints, code in replies.values() if code == 200 and hints['process'] == 'running')
+
+                assert run(self.proxy, _query), 'dependency %s is not running' % qualified
+
+            _spin()
+
     def join(self, timeout=None):
 
         Thread.join(self)
         return self.out
 
 
+def _immutable(image, patterns):
+    """
+    Returns True if the docker image reference cannot change over time, e.g if it is pinned by digest (foo@sha256:...)
+    or if its tag matches one of the specified glob patterns (e.g v*). A missing tag means 'latest'.
+    """
+
+    if '@sha256:' in image:
+        return True
+
+    name = image.split('/')[-1]
+    tag = name.split(':')[-1] if ':' in name else 'latest'
+    return any(fnmatch.fnmatch(tag, pattern) for pattern in patterns)
+
+
+def _waves(pods, old, batch, surge):
+    """
+    Plans a rolling deployment replacing old pods by the specified number of new pods. Each wave scales the new
+    application up by at most batch pods (while never exceeding the target by more than surge pods) and then phases
+    out up to batch old pods. The first wave always brings new pods up (even if that means going over the surge) and
+    no old pod is phased out before then. The number of pods up never drops below the target minus the batch size.
+    Returns a list of (instances, drop) tuples.
+    """
+
+    assert batch > 0, 'the batch size must be at least 1'
+    waves = []
+    new = 0
+    while new < pods or old:
+
+        #
+        # - grow within the surge (the very first wave must grow no matter what)
+        # - then phase out whatever is over the target, or up to batch pods if we could not grow
+        #
+        room = pods + surge - new - old
+        grow = min(batch, pods - new, max(0, room) if new else batch)
+        new += grow
+        floor = pods - batch
+        drop = min(batch, old, max(0, new + old - (pods if grow else floor)))
+        old -= drop
+        waves.append((new, drop))
+
+    return waves
+
+
+def _plan(containers, namespace):
+    """
+    Peeks at the container definitions and sorts them based on their optional 'depends_on' setting (e.g a list of
+    cluster identifiers). Returns the templates in topological order plus their dependencies, which are either
+    clusters we deploy along with (template) or external clusters (fully qualified).
+    """
+
+    names = {}
+    declared = {}
+    for template in containers:
+        try:
+            with open(template, 'r') as f:
+                raw = yaml.load(f) or {}
+                names[raw['cluster']] = template
+                declared[template] = raw.get('depends_on') or []
+
+        except (IOError, KeyError, TypeError, YAMLError):
+
+            #
+            # - the thread will report any issue with that definition later on
+            #
+            declared[template] = []
+
+    internal = {template: {cluster: names[cluster] for cluster in deps if cluster in names} for template, deps in declared.items()}
+    external = {template: ['%s.%s' % (namespace, cluster) for cluster in deps if cluster not in names] for template, deps in declared.items()}
+
+    ordered = []
+    left = list(containers)
+    while left:
+        ready = [template for template in left if all(dep in ordered for dep in internal[template].values())]
+        assert ready, 'circular dependency between %s' % ', '.join(left)
+        ordered += ready
+        left = [template for template in left if template not in ready]
+
+    return ordered, internal, external
+
+
 def go():
 
     class _Tool(Template):
@@ -321,9 +672,30 @@ def go():
                 a suffix to the cluster identifier defined in the yaml configuration by using the -s option (typically
                 to run the same functionality in different contexts).
 
+                Using --group will submit all the applications at once as a single marathon group (e.g one scheduler
+                round-trip) and track them together.
+
+                Using --batch will roll the pods previously running for the cluster over in waves : the new application
+                is scaled up by the specified number of pods (--max-surge sets how many pods we can run above the
+                target), the wave is then gated on these new pods being up (running with --strict, running or stopped
+                otherwise) and as many old pods are phased out. The -c delay is then applied before each phase-out.
+
+                A container definition may list other clusters it depends on via its 'depends_on' setting. The
+                definitions are then deployed in dependency order, each cluster only being deployed once all of its
+                dependencies are running. The critical path (the longest chain of dependent deployments) is reported
+                in seconds.
+
+                A digest of each application definition is stored as a marathon label. If the pods currently running
+                for a cluster belong to an application with the same digest nothing will be deployed (the application
+                will just be scaled if -p is specified). This only applies to immutable image references (see below) :
+                a mutable one such as foo:latest is always deployed again since its image may have changed. Use --force
+                to always deploy a new application.
+
                 This tool supports optional output in JSON format for 3rd-party integration via the -j switch.
 
-                Please note we force a docker image pull when instantiating the new application.
+                Please note we only force a docker image pull when the image reference is mutable : images pinned by
+                digest (foo@sha256:...) or whose tag matches one of the --immutable glob patterns (or $OCHOPOD_IMMUTABLE)
+                are only pulled if missing.
             '''
 
         tag = 'deploy'
@@ -338,6 +710,11 @@ def go():
             parser.add_argument('-p', action='store', dest='pods', type=int, help='number of pods to deploy')
             parser.add_argument('-s', action='store', dest='suffix', type=str, help='optional cluster suffix')
             parser.add_argument('-t', action='store', dest='timeout', type=int, default=60, help='timeout in seconds')
+            parser.add_argument('--batch', action='store', dest='batch', type=int, help='rolling mode, number of pods per wave')
+            parser.add_argument('--force', action='store_true', dest='force', help='deploys even if the definition did not change')
+            parser.add_argument('--immutable', action='store', dest='immutable', type=str, nargs='+', help='immutable tag glob pattern(s), e.g v*')
+            parser.add_argument('--group', action='store_true', dest='group', help='submits all the applications as one marathon group')
+            parser.add_argument('--max-surge', action='store', dest='surge', type=int, default=0, help='rolling mode, extra pods allowed above the target')
             parser.add_argument('--strict', action='store_true', dest='strict', help='waits until all pods are running')
 
         def body(self, args, proxy):
@@ -368,27 +745,51 @@ def go():
 
             #
             # - run the workflow proper (one thread per container definition)
+            # - with --group the threads will submit their application via one single marathon group
+            # - the threads are started in dependency order and each will wait for its own dependencies
+            # - the clusters others depend on must have all their pods running (e.g as if --strict was set)
             #
-            threads = {template: _Automation(
-                proxy,
-                template,
-                overrides,
-                args.namespace,
-                args.pods,
-                args.cycle,
-                args.suffix,
-                args.timeout,
-                args.strict) for template in args.containers}
+            ordered, internal, external = _plan(args.containers, args.namespace)
+            required = set(dep for deps in internal.values() for dep in deps.values())
+            immutable = (args.immutable or []) + [pattern for pattern in os.environ.get('OCHOPOD_IMMUTABLE', '').split(',') if pattern]
+            batch = _Batch(args.namespace, len(args.containers)) if args.group else None
+            threads = {}
+            for template in ordered:
+                threads[template] = _Automation(
+                    proxy,
+                    template,
+                    overrides,
+                    args.namespace,
+                    args.pods,
+                    args.cycle,
+                    args.suffix,
+                    args.timeout,
+                    args.strict or template in required,
+                    batch=batch,
+                    after={cluster: threads[dep] for cluster, dep in internal[template].items()},
+                    external=external[template],
+                    rolling=(args.batch, args.surge) if args.batch else None,
+                    force=args.force,
+                    immutable=immutable)
 
             #
             # - wait for all our threads to join
+            # - compute the critical path (e.g the longest chain of dependent deployments)
+            # - in batch mode the threads run concurrently and already include the time spent on their dependencies
             #
             n = len(threads)
             outcome = {key: thread.join() for key, thread in threads.items()}
+            critical = {}
+            for template in ordered:
+                deps = [critical[dep] for dep in internal[template].values()] if not batch else []
+                critical[template] = threads[template].elapsed + max(deps or [0])
+                outcome[template]['critical'] = int(critical[template])
+
             pct = (100 * sum(1 for _, js in outcome.items() if js['ok'])) / n if n else 0
             up = sum(len(js['up']) for _, js in outcome.items())
             down = sum(len(js['down']) for _, js in outcome.items())
-            logger.info(json.dumps(outcome) if args.json else '%d%% success (+%d/-%d)' % (pct, up, down))
+            longest = max(critical.values()) if critical else 0
+            logger.info(json.dumps(outcome) if args.json else '%d%% success (+%d/-%d, critical path %d s)' % (pct, up, down, longest))
             return 0 if pct == 100 else 1
 
     return _Tool()
\ No newline at end of file
@@ -16,7 +16,7 @@
 #
 import logging
 
-from toolset.io import fire, run
+from toolset.io import fire, peek, run, split
 from toolset.tool import Template
 
 #: Our ochopod logger.
@@ -29,7 +29,8 @@ def go():
 
         help = \
             '''
-                Displays high-level information for the specified cluster(s).
+                Displays high-level information for the specified cluster(s). Using --fast will only display what is
+                registered in zookeeper without contacting the pods (e.g no process nor state).
             '''
 
         tag = 'grep'
@@ -37,17 +38,39 @@ def go():
         def customize(self, parser):
 
             parser.add_argument('clusters', type=str, nargs='*', default='*', help='1+ clusters (can be a glob pattern, e.g foo*)')
+            parser.add_argument('--fast', action='store_true', dest='fast', help='registry lookup only (no process/state)')
 
         def body(self, args, proxy):
 
-            for token in args.clusters:
+            if args.fast:
 
+                #
+                # - the pod IP & node are part of the zookeeper registration
+                # - the process & state are live fields which would require a HTTP call per pod
+                #
                 def _query(zk):
-                    replies = fire(zk, token, 'info')
-                    return len(replies), [[key, '|', hints['ip'], '|', hints['node'], '|', hints['process'], '|', hints['state']]
-                                          for key, (_, hints, code) in sorted(replies.items()) if code == 200]
+                    pods = peek(zk, args.clusters)
+                    return {key: [key, '|', hints['ip'], '|', hints['node']] for key, hints in pods.items()}
 
-                total, js = run(proxy, _query)
+                header = ['pod', '|', 'pod IP', '|', 'node']
+
+            else:
+
+                def _query(zk):
+                    replies = fire(zk, args.clusters, 'info')
+                    return {key: [key, '|', hints['ip'], '|', hints['node'], '|', hints['process'], '|', hints['state']] if code == 200 else None
+                            for key, (_, hints, code) in replies.items()}
+
+                header = ['pod', '|', 'pod IP', '|', 'node', '|', 'process', '|', 'state']
+
+            #
+            # - resolve all our patterns at once (e.g one single fan-out, each pod is contacted once)
+            # - then display the results per pattern
+            #
+            for token, found in split(run(proxy, _query), args.clusters):
+
+                total = len(found)
+                js = [row for _, row in sorted(found.items()) if row]
                 if js:
 
                     #
@@ -55,7 +78,7 @@ def go():
                     #
                     pct = (len(js) * 100) / total
                     logger.info('<%s> -> %d%% replies (%d pods total) ->\n' % (token, pct, len(js)))
-                    rows = [['pod', '|', 'pod IP', '|', 'node', '|', 'process', '|', 'state'], ['', '|', '', '|', '', '|', '', '|', '']] + js
+                    rows = [header, ['' if val != '|' else val for val in header]] + js
                     widths = [max(map(len, col)) for col in zip(*rows)]
                     for row in rows:
                         logger.info('  '.join((val.ljust(width) for val, width in zip(row, widths))))
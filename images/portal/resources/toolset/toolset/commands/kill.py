@@ -16,14 +16,13 @@
 #
 import json
 import logging
-import os
+import time
 
 from ochopod.core.fsm import diagnostic
-from ochopod.core.utils import retry
-from random import choice
-from requests import get, delete
-from threading import Thread
-from toolset.io import fire, run
+from random import uniform
+from threading import Event, Semaphore, Thread
+from toolset.io import fire, lookup, members, run, stream, watch
+from toolset.marathon import client
 from toolset.tool import Template
 
 #: Our ochopod logger.
@@ -36,10 +35,11 @@ class _Automation(Thread):
         super(_Automation, self).__init__()
 
         self.cluster = cluster
+        self.dead = {}
         self.out = \
             {
                 'ok': False,
-                'down': 0
+                'down': []
             }
         self.proxy = proxy
         self.subset = subset
@@ -51,38 +51,60 @@ class _Automation(Thread):
         try:
 
             #
-            # - we need to pass the framework master IPs around (ugly)
+            # - kill all (or part of) the pods using a POST /control/kill
+            # - warning, /control/kill will block (hence the 5 seconds timeout)
+            # - any pod reporting back a HTTP 410 (GONE) is already dead (e.g its ochopod state-machine is idling)
+            # - pods that did not reply at all are still pending (and will be sent /control/kill again)
+            # - idle standby pods are not part of the cluster and are left alone
             #
-            assert 'MARATHON_MASTER' in os.environ, '$MARATHON_MASTER not specified (check your portal pod)'
-            master = choice(os.environ['MARATHON_MASTER'].split(','))
-            headers = \
-                {
-                    'content-type': 'application/json',
-                    'accept': 'application/json'
-                }
+            def _query(zk):
+                pods = members(zk, self.cluster, subset=self.subset)
+                return [(code, pod.seq) for _, pod, _, code in stream(pods, 'control/kill', timeout=self.timeout)]
+
+            js = run(self.proxy, _query)
+            pending = set(seq for code, seq in js if code != 410)
+            unacked = set(seq for code, seq in js if not code)
+            down = sorted(seq for _, seq in js)
 
             #
-            # - kill all (or part of) the pods using a POST /control/kill
-            # - wait for them to be dead
-            # - warning, /control/kill will block (hence the 5 seconds timeout)
+            # - now wait for the other pods to be dead without firing /control/kill again (unless they never replied)
+            # - only query the pods that are still pending, pods that unregistered are considered gone
+            # - back off exponentially (with some jitter) between each check
+            # - a zookeeper watch on the cluster will wake us up early if pods come and go
             #
-            @retry(timeout=self.timeout, pause=0)
-            def _spin():
-                def _query(zk):
-                    replies = fire(zk, self.cluster, 'control/kill', subset=self.subset, timeout=self.timeout)
-                    return [(code, seq) for seq, _, code in replies.values()]
+            latch = Event()
+            stop = Event()
+            ts = time.time()
+            if pending:
+                run(self.proxy, lambda zk: watch(zk, self.cluster, latch, stop))
 
-                #
-                # - fire the request one or more pods
-                # - wait for every pod to report back a HTTP 410 (GONE)
-                # - this means the ochopod state-machine is now idling (e.g dead)
-                #
-                js = run(self.proxy, _query)
-                gone = sum(1 for code, _ in js if code == 410)
-                assert gone == len(js), 'at least one pod is still running'
-                return [seq for _, seq in js]
+            try:
+
+                pause = 0.5
+                while pending:
+
+                    latch.clear()
+
+                    def _query(zk):
+                        registered = [pod.seq for pod in lookup(zk, self.cluster, subset=list(pending)).values()]
+                        retry = [seq for seq in registered if seq in unacked]
+                        acked = fire(zk, self.cluster, 'control/kill', subset=retry, timeout=self.timeout) if retry else {}
+                        replies = fire(zk, self.cluster, 'info', subset=registered) if registered else {}
+                        return registered, [seq for seq, _, _ in acked.values()], [seq for seq, hints, code in replies.values() if code == 200 and hints['process'] == 'dead']
+
+                    registered, acked, dead = run(self.proxy, _query)
+                    unacked -= set(acked)
+                    pending = set(registered) - set(dead)
+                    if pending:
+                        left = self.timeout - (time.time() - ts)
+                        assert left > 0, '%d pod(s) still running' % len(pending)
+                        latch.wait(min(left, pause * uniform(0.5, 1.0)))
+                        pause = min(pause * 2, 8.0)
+
+            finally:
+
+                stop.set()
 
-            down = _spin()
             self.out['down'] = down
             assert down, 'the cluster is either invalid or empty'
             logger.debug('%s : %d pods are dead -> %s' % (self.cluster, len(down), ', '.join(['#%d' % seq for seq in down])))
@@ -91,38 +113,14 @@ class _Automation(Thread):
             # - now look our all our pods up and focus on the dead ones
             # - this may include pods that were already phased out earlier
             # - we want to know if we can now nuke the underlying marathon application(s)
+            # - the marathon clean-up itself is done in bulk once all the threads are done
             #
             def _query(zk):
                 replies = fire(zk, self.cluster, 'info')
-                return [hints['application'] for key, (_, hints, _) in replies.items() if hints['process'] == 'dead']
-
-            js = run(self.proxy, _query)
-            rollup = {key: 0 for key in set(js)}
-            for key in js:
-                rollup[key] += 1
-
-            for application, total in rollup.items():
+                return [hints['application'] for _, hints, code in replies.values() if code == 200 and hints['process'] == 'dead']
 
-                #
-                # - query the marathon application and check how many tasks it currently has
-                #
-                url = 'http://%s/v2/apps/%s/tasks' % (master, application)
-                reply = get(url, headers=headers)
-                code = reply.status_code
-                logger.debug('%s : -> %s (HTTP %d)' % (self.cluster, url, code))
-                assert code == 200, 'task lookup failed (HTTP %d)' % code
-                js = reply.json()
-                if len(js['tasks']) == total:
-
-                    #
-                    # - all the containers running for that application were reported as dead
-                    # - issue a DELETE /v2/apps to nuke it altogether
-                    #
-                    url = 'http://%s/v2/apps/%s' % (master, application)
-                    reply = delete(url, headers=headers)
-                    code = reply.status_code
-                    logger.debug('%s : -> %s (HTTP %d)' % (self.cluster, url, code))
-                    assert code == 200 or code == 204, 'application deletion failed (HTTP %d)' % code
+            for application in run(self.proxy, _query):
+                self.dead[application] = self.dead.get(application, 0) + 1
 
             self.out['ok'] = True
 
@@ -140,6 +138,100 @@ class _Automation(Thread):
         return self.out
 
 
+def _cleanup(dead, parallelism=8):
+    """
+    Deletes the marathon applications whose tasks were all reported as dead (dead maps each application to its number
+    of dead pods). The task counts are retrieved at once for all the applications and the deletions are issued
+    concurrently (up to the specified parallelism). Returns the applications we failed to delete.
+    """
+
+    if not dead:
+        return []
+
+    #
+    # - query all our marathon applications at once with their tasks embedded
+    # - only keep the ones whose task count matches their number of dead pods
+    #
+    marathon = client()
+    reply = marathon.get('/v2/apps', params={'id': 'ochopod.', 'embed': 'apps.tasks'})
+    code = reply.status_code
+    assert code == 200, 'application lookup failed (HTTP %d)' % code
+    tasks = {js['id'].lstrip('/'): len(js.get('tasks', [])) for js in reply.json()['apps']}
+    doomed = [application for application, total in dead.items() if tasks.get(application) == total]
+
+    failed = []
+    gate = Semaphore(parallelism)
+
+    def _delete(application):
+        with gate:
+            try:
+
+                #
+                # - all the containers running for that application were reported as dead
+                # - issue a DELETE /v2/apps to nuke it altogether
+                #
+                reply = marathon.delete('/v2/apps/%s' % application)
+                code = reply.status_code
+                assert code == 200 or code == 204, 'application deletion failed (HTTP %d)' % code
+
+            except Exception as failure:
+
+                logger.debug('%s : failed to delete -> %s' % (application, diagnostic(failure)))
+                failed.append(application)
+
+    threads = [Thread(target=_delete, args=(application,)) for application in doomed]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return failed
+
+
+def kill(proxy, clusters, subset=None, timeout=60):
+    """
+    Gracefully kills the pods for the specified cluster(s) (or only the ones whose sequence index is in subset) using
+    the zookeeper proxy. Any marathon application whose pods are all dead is then deleted. This is the workflow
+    behind the kill tool and can be invoked in-process by other tools. Returns a dict mapping each cluster to
+    its outcome (e.g 'ok' plus the sequence indices of the pods that are now dead).
+    """
+
+    #
+    # - run the workflow proper (one thread per cluster)
+    #
+    threads = {cluster: _Automation(
+        proxy,
+        cluster,
+        subset,
+        timeout) for cluster in clusters}
+
+    #
+    # - wait for all our threads to join
+    # - delete the marathon applications whose pods are all dead (in one go)
+    # - the same application may be reported by more than one thread if the cluster patterns overlap
+    #
+    outcome = {key: thread.join() for key, thread in threads.items()}
+    applications = {}
+    for thread in threads.values():
+        for application, total in thread.dead.items():
+            applications[application] = max(total, applications.get(application, 0))
+
+    try:
+        failed = _cleanup(applications)
+
+    except Exception as failure:
+
+        logger.debug('failed to cleanup -> %s' % diagnostic(failure))
+        failed = applications.keys()
+
+    for key, thread in threads.items():
+        if any(application in failed for application in thread.dead):
+            outcome[key]['ok'] = False
+
+    return outcome
+
+
 def go():
 
     class _Tool(Template):
@@ -170,19 +262,10 @@ def go():
             assert args.force or args.subset, 'you must specify --force if -i is not set'
 
             #
-            # - run the workflow proper (one thread per container definition)
-            #
-            threads = {cluster: _Automation(
-                proxy,
-                cluster,
-                args.subset,
-                args.timeout) for cluster in args.clusters}
-
-            #
-            # - wait for all our threads to join
+            # - run the kill workflow proper
             #
-            n = len(threads)
-            outcome = {key: thread.join() for key, thread in threads.items()}
+            outcome = kill(proxy, args.clusters, subset=args.subset, timeout=args.timeout)
+            n = len(outcome)
             dead = sum(len(js['down']) for _, js in outcome.items())
             pct = (100 * sum(1 for _, js in outcome.items() if js['ok'])) / n if n else 0
             logger.info(json.dumps(outcome) if args.json else '%d%% success (%d dead pods)' % (pct, dead))
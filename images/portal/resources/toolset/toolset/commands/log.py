@@ -14,14 +14,85 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import heapq
+import json
 import logging
+import os
+import re
+import requests
+import time
 
-from toolset.io import fire, run
+from toolset.io import members, run, split, stream
 from toolset.tool import Template
 
 #: Our ochopod logger.
 logger = logging.getLogger('ochopod')
 
+#: Leading timestamp of a log line (e.g 2015-09-01 17:03:45,367).
+_STAMP = re.compile(r'^(\d{4}-\d{2}-\d{2})[ T](\d{2}:\d{2}:\d{2})(?:[,.](\d+))?')
+
+
+def _trim(lines, tail=None, regex=None, budget=None):
+
+    #
+    # - filter, keep the last lines and cap the number of bytes (the most recent lines are kept)
+    #
+    if regex:
+        lines = [line for line in lines if regex.search(line)]
+    if tail:
+        lines = lines[-tail:]
+    if budget is not None:
+        total = 0
+        for n in range(len(lines) - 1, -1, -1):
+            total += len(lines[n])
+            if total > budget:
+                return lines[n + 1:]
+    return lines
+
+
+def unpack(reply, cursor, tail, regex, budget):
+    """
+    Turns a pod log reply into the list of lines to display plus the cursor to use next. Pods honoring our request
+    reply with {'lines': [...], 'cursor': ...}. Older pods send their whole log back : the same slicing is then
+    applied on our end and the last line we saw acts as the cursor (we only keep what follows it).
+    """
+
+    if isinstance(reply, dict):
+        return _trim(reply.get('lines', []), tail, regex, budget), (True, reply.get('cursor'))
+
+    lines = reply
+    if cursor:
+        for n in range(len(lines) - 1, -1, -1):
+            if lines[n] == cursor[1]:
+                lines = lines[n + 1:]
+                break
+
+    return _trim(lines, tail, regex, budget), (False, reply[-1] if reply else cursor[1] if cursor else None)
+
+
+def _stream(key, lines):
+
+    #
+    # - yield (timestamp, key, line) tuples with a normalized timestamp that sorts lexicographically
+    # - lines without a timestamp (e.g stack traces) inherit the one from the previous line
+    #
+    stamp = ''
+    for line in lines:
+        matched = _STAMP.match(line)
+        if matched:
+            day, hms, frac = matched.groups()
+            stamp = '%s %s.%s' % (day, hms, (frac or '')[:6].ljust(6, '0'))
+        yield stamp, key, line
+
+
+def _merge(js):
+
+    #
+    # - k-way merge of the per-pod logs (each one is already time-ordered)
+    # - the lines are streamed one at a time (e.g we never build the merged log)
+    #
+    return heapq.merge(*[_stream(key, log) for key, log in js.items()])
+
 
 def go():
 
@@ -30,7 +101,12 @@ def go():
         help = \
             '''
                 Dumps the internal ochopod log for the specified cluster(s). Can also dump callback application
-                logs with the --application flag.
+                logs with the --application flag. The number of lines, the filtering (--grep) and the total
+                number of bytes are passed down to the pods so that only what is needed is sent back. The -f switch
+                will keep polling the pods for new lines only until the timeout expires. The --merge switch will
+                interleave the lines from all the pods in chronological order (each line is tagged with its pod).
+                If the portal collects the logs, --search will look the most recent lines featuring all the specified
+                words up without contacting the pods.
             '''
 
         tag = 'log'
@@ -38,22 +114,101 @@ def go():
         def customize(self, parser):
 
             parser.add_argument('clusters', type=str, nargs='*', default='*', help='1+ clusters (can be a glob pattern, e.g foo*)')
+            parser.add_argument('-b', '--bytes', action='store', dest='bytes', type=int, default=1048576, help='maximum number of bytes to transfer')
+            parser.add_argument('-f', action='store_true', dest='follow', help='follow the log(s)')
             parser.add_argument('-l', action='store_true', dest='long', help='display the entire log')
+            parser.add_argument('-n', action='store', dest='lines', type=int, default=16, help='number of lines to display')
+            parser.add_argument('-t', action='store', dest='timeout', type=int, default=60, help='how long to follow for in seconds')
             parser.add_argument('-a', '--application', action='store_true', help="display logs for pod's configure() callback application")
+            parser.add_argument('--grep', action='store', dest='grep', type=str, help='only display the lines matching this regex')
+            parser.add_argument('--merge', action='store_true', dest='merge', help='merge the logs in chronological order')
+            parser.add_argument('--search', action='store', dest='search', type=str, help='search the logs collected by the portal')
 
         def body(self, args, proxy):
 
-            for token in args.clusters:
+            if args.search:
+
+                #
+                # - query the portal log collector (no pod is contacted)
+                #
+                assert 'OCHOPOD_COLLECTOR' in os.environ, 'the log collector is not enabled on this portal'
+                for token in args.clusters:
+                    params = {'q': args.search, 'clusters': token, 'limit': 0 if args.long else args.lines}
+                    reply = requests.get('%s/log/search' % os.environ['OCHOPOD_COLLECTOR'], params=params, timeout=10.0)
+                    code = reply.status_code
+                    assert code == 200, 'search failed (HTTP %d)' % code
+                    js = reply.json()
+                    for cluster, lines in sorted(js['hits'].items()):
+                        logger.info('<%s> -> %d hits (%d ms) ->\n\n%s\n' % (cluster, len(lines), js['ms'], '\n'.join(lines)))
+                return
+
+            regex = re.compile(args.grep) if args.grep else None
+            command = 'log/app' if args.application else 'log'
+            cursors = {}
+
+            def _poll(tail):
 
                 def _query(zk):
-                    replies = fire(zk, token, ('log/app' if args.application else 'log'))
-                    return len(replies), {key: log for key, (_, log, code) in replies.items() if code == 200}
 
-                total, js = run(proxy, _query)
-                if js:
+                    #
+                    # - resolve all our patterns at once (e.g one single lookup & fan-out, each pod is contacted once)
+                    # - split our byte budget evenly across the pods
+                    # - pass our limits and the per-pod cursor (if any) in the request body
+                    # - truncated replies (HTTP 413) are skipped, as fire() would
+                    #
+                    pods = members(zk, args.clusters)
+                    budget = args.bytes / max(1, len(pods))
+
+                    def _request(key):
+                        js = {'tail': tail, 'grep': args.grep, 'bytes': budget}
+                        native, cursor = cursors.get(key, (False, None))
+                        if native:
+                            js['cursor'] = cursor
+                        return json.dumps(js)
+
+                    replies = stream(pods, command, js=_request)
+                    return budget, {key: log if code == 200 else None for key, _, log, code in replies if code and code != 413}
+
+                #
+                # - pods that did not reply properly are mapped to None
+                #
+                budget, js = run(proxy, _query)
+                out = {}
+                for key, reply in js.items():
+                    out[key] = None
+                    if reply is not None:
+                        out[key], cursors[key] = unpack(reply, cursors.get(key), tail, regex, budget)
+                return out
+
+            tail = None if args.long else args.lines
+            for token, found in split(_poll(tail), args.clusters):
+
+                total = len(found)
+                js = {key: log for key, log in found.items() if log is not None}
+                if js and args.merge:
+                    pct = ((len(js) * 100) / total)
+                    logger.info('<%s> -> %d%% replies (%d pods total) ->\n' % (token, pct, len(js)))
+                    for _, key, line in _merge(js):
+                        logger.info('%s | %s' % (key, line.rstrip()))
+
+                elif js:
                     pct = ((len(js) * 100) / total)
-                    unrolled = ['- %s\n\n  %s' % (key, '  '.join(log if args.long else log[-16:])) for key, log in js.items()]
+                    unrolled = ['- %s\n\n  %s' % (key, '  '.join(log)) for key, log in js.items()]
                     logger.info('<%s> -> %d%% replies (%d pods total) ->\n%s' % (token, pct, len(js), '\n'.join(unrolled)))
 
+            if args.follow:
+
+                #
+                # - keep polling for new lines only (the pods will resume from our cursors)
+                # - tag each line with its pod key
+                #
+                ts = time.time()
+                while time.time() - ts < args.timeout:
+
+                    time.sleep(1.0)
+                    js = {key: log for key, log in _poll(None).items() if log is not None}
+                    tagged = _merge(js) if args.merge else ((None, key, line) for key, log in sorted(js.items()) for line in log)
+                    for _, key, line in tagged:
+                        logger.info('%s | %s' % (key, line.rstrip()))
 
-    return _Tool()
\ No newline at end of file
+    return _Tool()
@@ -17,7 +17,7 @@
 import json
 import logging
 
-from toolset.io import fire, run
+from toolset.io import fire, peek, run
 from toolset.tool import Template
 
 #: Our ochopod logger.
@@ -31,7 +31,8 @@ def go():
         help = \
             '''
                 Lists all the ochopod cluster(s) currently active. The number of containers that are tagged as running
-                is indicated as well as the optional status status line.
+                is indicated as well as the optional status status line. Using --fast will only count the pods registered
+                in zookeeper without contacting them (e.g no process state nor status line).
 
                 This tool supports optional output in JSON format for 3rd-party integration via the -j switch.
             '''
@@ -41,9 +42,40 @@ def go():
         def customize(self, parser):
 
             parser.add_argument('-j', action='store_true', dest='json', help='json output')
+            parser.add_argument('--fast', action='store_true', dest='fast', help='registry lookup only (no pod i/o)')
 
         def body(self, args, proxy):
 
+            if args.fast:
+
+                #
+                # - the cluster/pod breakdown is available from zookeeper directly
+                # - don't bother contacting the pods
+                #
+                def _query(zk):
+                    return peek(zk, '*')
+
+                js = run(proxy, _query)
+                if js:
+
+                    out = {}
+                    for key in js:
+                        qualified = key.split(' ')[0]
+                        out[qualified] = out.get(qualified, 0) + 1
+
+                    if args.json:
+                        logger.info(json.dumps({key: {'total': n} for key, n in out.items()}))
+
+                    else:
+                        logger.info('%d pods (zookeeper only) ->\n' % len(js))
+                        unrolled = [[key, '|', '%d' % n] for key, n in sorted(out.items())]
+                        rows = [['cluster', '|', 'pods'], ['', '|', '']] + unrolled
+                        widths = [max(map(len, col)) for col in zip(*rows)]
+                        for row in rows:
+                            logger.info('  '.join((val.ljust(width) for val, width in zip(row, widths))))
+
+                return
+
             def _query(zk):
                 replies = fire(zk, '*', 'info')
                 return len(replies), {key: hints for key, (_, hints, code) in replies.items() if code == 200}
@@ -16,7 +16,7 @@
 #
 import logging
 
-from toolset.io import fire, run
+from toolset.io import fire, run, split
 from toolset.tool import Template
 
 #: Our ochopod logger.
@@ -43,13 +43,18 @@ def go():
 
         def body(self, args, proxy):
 
-            for token in args.clusters:
+            #
+            # - resolve all our patterns at once (e.g one single fan-out, each pod is contacted once)
+            # - then report per pattern
+            #
+            def _query(zk):
+                replies = fire(zk, args.clusters, 'control/on', subset=args.subset)
+                return {key: code for key, (_, _, code) in replies.items()}
 
-                def _query(zk):
-                    replies = fire(zk, token, 'control/on', subset=args.subset)
-                    return len(replies), [pod for pod, (_, _, code) in replies.items() if code == 200]
+            for token, codes in split(run(proxy, _query), args.clusters):
 
-                total, js = run(proxy, _query)
+                total = len(codes)
+                js = [key for key, code in codes.items() if code == 200]
                 if js:
                     pct = (len(js) * 100) / total
                     logger.info('<%s> -> %d%% replies, %d pods on' % (token, pct, len(js)))
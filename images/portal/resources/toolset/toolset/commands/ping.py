@@ -16,9 +16,11 @@
 #
 import json
 import logging
+import math
 import yaml
 
-from toolset.io import fire, run
+from collections import Counter
+from toolset.io import field, members, run, stream
 from toolset.tool import Template
 from yaml import YAMLError
 
@@ -26,6 +28,89 @@ from yaml import YAMLError
 logger = logging.getLogger('ochopod')
 
 
+class _Sum():
+    """
+    Running sum of a numeric field.
+    """
+
+    def __init__(self, path):
+
+        self.missing = 0
+        self.n = 0
+        self.path = path
+        self.total = 0.0
+
+    def update(self, js):
+        try:
+            self.total += float(field(js, self.path))
+            self.n += 1
+        except (KeyError, TypeError, ValueError):
+            self.missing += 1
+
+    def result(self):
+        return {'sum': self.total, 'n': self.n, 'missing': self.missing}
+
+
+class _Histogram(_Sum):
+    """
+    Histogram of a numeric field using power of 2 buckets (each bucket is keyed by its upper bound).
+    """
+
+    def __init__(self, path):
+        _Sum.__init__(self, path)
+
+        self.buckets = Counter()
+
+    def update(self, js):
+        try:
+            value = float(field(js, self.path))
+            if math.isinf(value) or math.isnan(value):
+                raise ValueError
+
+            #
+            # - value = mantissa * 2 ** exponent with the mantissa in [0.5, 1) : exact powers of 2 have a mantissa of
+            #   0.5 and are their own upper bound (no floating point rounding as with log())
+            #
+            mantissa, exponent = math.frexp(value)
+            self.buckets[0 if value <= 0 else 2 ** (exponent - 1 if mantissa == 0.5 else exponent)] += 1
+            self.n += 1
+        except (KeyError, TypeError, ValueError):
+            self.missing += 1
+
+    def result(self):
+        return {'buckets': {str(bound): n for bound, n in self.buckets.items()}, 'n': self.n, 'missing': self.missing}
+
+
+class _CountBy(_Sum):
+    """
+    Number of pods per distinct value of a field.
+    """
+
+    def __init__(self, path):
+        _Sum.__init__(self, path)
+
+        self.counts = Counter()
+
+    def update(self, js):
+        try:
+            self.counts[str(field(js, self.path))] += 1
+            self.n += 1
+        except (KeyError, TypeError):
+            self.missing += 1
+
+    def result(self):
+        return {'counts': dict(self.counts), 'n': self.n, 'missing': self.missing}
+
+
+#: Reducers available via --reduce <kind>:<field>.
+_REDUCERS = \
+    {
+        'count-by': _CountBy,
+        'histogram': _Histogram,
+        'sum': _Sum
+    }
+
+
 def go():
 
     class _Tool(Template):
@@ -35,6 +120,11 @@ def go():
                 Sends a block of arbitrary YAML data to the specified cluster(s). Each container will receive the
                 data as a dict and pass it to its signal() callback for processing.
 
+                The replies can be streamed as they come back (one JSON object per line) using --ndjson. They can
+                also be aggregated on the fly using one or more --reduce switches (sum:<field>, histogram:<field> or
+                count-by:<field>, the field being a dotted path into each reply) in which case only the aggregates
+                are displayed.
+
                 This tool supports optional output in JSON format for 3rd-party integration via the -j switch.
             '''
 
@@ -45,27 +135,60 @@ def go():
             parser.add_argument('yaml', nargs=1, help='YAML file')
             parser.add_argument('clusters', type=str, nargs='*', default='*', help='1+ clusters (can be a glob pattern, e.g foo*)')
             parser.add_argument('-j', action='store_true', dest='json', help='json output')
+            parser.add_argument('--ndjson', action='store_true', dest='ndjson', help='streams one json reply per line')
+            parser.add_argument('--reduce', action='append', dest='reduce', default=[], help='aggregates the replies (e.g sum:stats.load)')
 
         def body(self, args, proxy):
 
+            reducers = []
+            for spec in args.reduce:
+                kind, _, path = spec.partition(':')
+                assert kind in _REDUCERS and path, 'invalid reducer "%s" (user error ?)' % spec
+                reducers.append((spec, _REDUCERS[kind](path)))
+
             try:
                 with open(args.yaml[0], 'r') as f:
                     payload = yaml.load(f)
 
+                #
+                # - resolve all our patterns at once (e.g each pod is pinged once)
+                # - process the replies as they come back : stream them and/or feed our reducers
+                # - the replies are only kept around if we need to dump them all at the end
+                #
+                pods = run(proxy, lambda zk: members(zk, args.clusters))
                 total = 0
+                replied = 0
                 merged = {}
-                for token in args.clusters:
-
-                    def _query(zk):
-                        replies = fire(zk, token, 'control/signal', js=json.dumps(payload))
-                        return len(replies), {key: data for key, (_, data, code) in replies.items() if code == 200}
-
-                    pods, js = run(proxy, _query)
-                    merged.update(js)
-                    total += pods
-
-                pct = (len(merged) * 100) / total if total else 0
-                logger.info(json.dumps(merged) if args.json else '%d%% replies, pinged %d pods' % (pct, len(merged)))
+                for key, _, data, code in stream(pods, 'control/signal', js=json.dumps(payload)):
+                    if not code:
+                        continue
+
+                    total += 1
+                    if code != 200:
+                        continue
+
+                    replied += 1
+                    for _, reducer in reducers:
+                        reducer.update(data)
+
+                    if args.ndjson:
+                        logger.info(json.dumps({'pod': key, 'reply': data}))
+                    elif args.json and not reducers:
+                        merged[key] = data
+
+                reduced = {spec: reducer.result() for spec, reducer in reducers}
+                if args.ndjson:
+                    if reduced:
+                        logger.info(json.dumps({'reduce': reduced}))
+
+                elif args.json:
+                    logger.info(json.dumps({'reduce': reduced} if reduced else merged))
+
+                else:
+                    pct = (replied * 100) / total if total else 0
+                    logger.info('%d%% replies, pinged %d pods' % (pct, replied))
+                    for spec, js in sorted(reduced.items()):
+                        logger.info('%s -> %s' % (spec, json.dumps(js)))
 
             except IOError:
 
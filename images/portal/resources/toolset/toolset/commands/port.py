@@ -16,7 +16,7 @@
 #
 import logging
 
-from toolset.io import fire, run
+from toolset.io import fire, peek, run, split
 from toolset.tool import Template
 
 #: Our ochopod logger.
@@ -29,7 +29,8 @@ def go():
 
         help = \
             '''
-                Displays the current remapping for a given TCP port across the specified cluster(s).
+                Displays the current remapping for a given TCP port across the specified cluster(s). Using --fast will
+                answer from zookeeper directly without contacting the pods.
             '''
 
         tag = 'port'
@@ -38,17 +39,37 @@ def go():
 
             parser.add_argument('port', type=int, nargs=1, help='TCP port to lookup')
             parser.add_argument('clusters', type=str, nargs='*', default='*', help='1+ clusters (can be a glob pattern, e.g foo*)')
+            parser.add_argument('--fast', action='store_true', dest='fast', help='registry lookup only (no pod i/o)')
 
         def body(self, args, proxy):
 
             port = str(args.port[0])
-            for cluster in args.clusters:
+            if args.fast:
 
+                #
+                # - the port remapping is part of the zookeeper registration
+                # - no need to contact each pod in that case
+                #
                 def _query(zk):
-                    replies = fire(zk, cluster, 'info')
-                    return len(replies), [[key, '|', hints['ip'], '|', hints['public'], '|', str(hints['ports'][port])] for key, (_, hints, code) in sorted(replies.items()) if code == 200 and port in hints['ports']]
+                    pods = peek(zk, args.clusters)
+                    return {key: [key, '|', hints['ip'], '|', hints['public'], '|', str(hints['ports'][port])] if port in hints['ports'] else None
+                            for key, hints in pods.items()}
 
-                total, js = run(proxy, _query)
+            else:
+
+                def _query(zk):
+                    replies = fire(zk, args.clusters, 'info')
+                    return {key: [key, '|', hints['ip'], '|', hints['public'], '|', str(hints['ports'][port])] if code == 200 and port in hints['ports'] else None
+                            for key, (_, hints, code) in replies.items()}
+
+            #
+            # - resolve all our patterns at once (e.g one single fan-out, each pod is contacted once)
+            # - then display the results per pattern
+            #
+            for cluster, found in split(run(proxy, _query), args.clusters):
+
+                total = len(found)
+                js = [row for _, row in sorted(found.items()) if row]
                 if js:
 
                     #
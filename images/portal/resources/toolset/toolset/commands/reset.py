@@ -16,10 +16,11 @@
 #
 import json
 import logging
+import time
 
 from ochopod.core.fsm import diagnostic
-from threading import Thread
-from toolset.io import fire, run
+from threading import BoundedSemaphore, Thread
+from toolset.io import members, post, run
 from toolset.tool import Template
 
 #: Our ochopod logger.
@@ -28,42 +29,86 @@ logger = logging.getLogger('ochopod')
 
 class _Automation(Thread):
 
-    def __init__(self, proxy, cluster, subset):
+    def __init__(self, proxy, cluster, subset, window, retries):
         super(_Automation, self).__init__()
 
         self.cluster = cluster
         self.out = \
             {
                 'ok': False,
-                'reset': []
+                'reset': [],
+                'failed': {}
             }
         self.proxy = proxy
+        self.retries = retries
         self.subset = subset
+        self.window = window
 
         self.start()
 
     def run(self):
         try:
 
-            def _query(zk):
-                replies = fire(zk, self.cluster, 'control/off', subset=self.subset)
-                return [seq for _, (seq, _, code) in replies.items() if code == 200]
+            #
+            # - lookup our pods once (idle standby pods are not part of the cluster)
+            # - each pod then goes through its own off -> reset -> on pipeline on a separate thread
+            # - the window bounds how many pods can be down at the same time
+            #
+            pods = run(self.proxy, lambda zk: members(zk, self.cluster, subset=self.subset))
+            window = BoundedSemaphore(self.window) if self.window else None
+
+            def _send(pod, command):
+
+                #
+                # - retry a few times with an exponential backoff
+                #
+                pause = 0.5
+                for _ in range(self.retries + 1):
+                    _, code = post(pod, command)
+                    if code == 200:
+                        return True
+
+                    time.sleep(pause)
+                    pause *= 2
+
+                return False
+
+            def _pipeline(pod):
+
+                if window:
+                    window.acquire()
+                try:
+
+                    if not _send(pod, 'control/off'):
+                        self.out['failed'][pod.seq] = 'off'
+
+                    elif not _send(pod, 'reset'):
 
-            js = run(self.proxy, _query)
+                        #
+                        # - don't leave the pod down if the reset failed
+                        #
+                        _send(pod, 'control/on')
+                        self.out['failed'][pod.seq] = 'reset'
 
-            def _query(zk):
-                replies = fire(zk, self.cluster, 'reset', subset=self.subset)
-                return [seq for _, (seq, _, code) in replies.items() if code == 200]
+                    elif not _send(pod, 'control/on'):
+                        self.out['failed'][pod.seq] = 'on'
 
-            assert js == run(self.proxy, _query), 'one or more pods did not respond'
+                    else:
+                        self.out['reset'].append(pod.seq)
 
-            def _query(zk):
-                replies = fire(zk, self.cluster, 'control/on', subset=self.subset)
-                return [seq for _, (seq, _, code) in replies.items() if code == 200]
+                finally:
+                    if window:
+                        window.release()
 
-            assert js == run(self.proxy, _query), 'one or more pods did not respond'
+            threads = [Thread(target=_pipeline, args=(pod,)) for _, pod in sorted(pods.items(), key=lambda item: item[1].seq)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
 
-            self.out['reset'] = js
+            self.out['reset'].sort()
+            logger.debug('%s : %d/%d pods reset' % (self.cluster, len(self.out['reset']), len(pods)))
+            assert not self.out['failed'], '%d pods failed' % len(self.out['failed'])
             self.out['ok'] = True
 
         except AssertionError as failure:
@@ -90,7 +135,8 @@ def go():
                 internal zookeeper coordinator will be restarted as well (but the container sequence index will remain
                 the same). Individual containers can also be cherry-picked by specifying their sequence index and
                 using -i. Please note you must by default use -i and specify what containers to reset. If you want to
-                reset multiple containers at once you must specify --force.
+                reset multiple containers at once you must specify --force. Each pod is reset independently (with
+                retries) and no more than -w pods will be down at the same time.
 
                 This tool supports optional output in JSON format for 3rd-party integration via the -j switch.
             '''
@@ -102,6 +148,8 @@ def go():
             parser.add_argument('clusters', type=str, nargs='*', default='*', help='1+ clusters (can be a glob pattern, e.g foo*)')
             parser.add_argument('-i', '--indices', action='store', dest='subset', type=int, nargs='+', help='1+ indices')
             parser.add_argument('-j', action='store_true', dest='json', help='json output')
+            parser.add_argument('-r', action='store', dest='retries', type=int, default=2, help='number of retries per step')
+            parser.add_argument('-w', action='store', dest='window', type=int, default=3, help='max number of pods down at once (0 for no limit)')
             parser.add_argument('--force', action='store_true', dest='force', help='enables wildcards')
 
         def body(self, args, proxy):
@@ -111,7 +159,7 @@ def go():
             #
             # - run the workflow proper (one thread per container definition)
             #
-            threads = {cluster: _Automation(proxy, cluster, args.subset) for cluster in args.clusters}
+            threads = {cluster: _Automation(proxy, cluster, args.subset, args.window, args.retries) for cluster in args.clusters}
 
             #
             # - wait for all our threads to join
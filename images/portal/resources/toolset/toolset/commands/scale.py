@@ -0,0 +1,208 @@
+#
+# Copyright (c) 2015 Autodesk Inc.
+# All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import logging
+
+from ochopod.core.fsm import diagnostic
+from threading import Thread
+from toolset.commands.kill import kill
+from toolset.io import fire, pooled, run
+from toolset.marathon import client
+from toolset.readiness import spin
+from toolset.standby import claim, newest, pool, refill
+from toolset.tool import Template
+
+#: Our ochopod logger.
+logger = logging.getLogger('ochopod')
+
+
+class _Automation(Thread):
+
+    def __init__(self, proxy, cluster, pods, timeout, strict):
+        super(_Automation, self).__init__()
+
+        self.cluster = cluster
+        self.out = \
+            {
+                'ok': False,
+                'up': [],
+                'down': []
+            }
+        self.pods = pods
+        self.proxy = proxy
+        self.strict = strict
+        self.timeout = max(timeout, 5)
+
+        self.start()
+
+    def run(self):
+        try:
+
+            #
+            # - lookup the pods currently alive for that cluster
+            # - the 'application' hint is set by design to the marathon application identifier
+            # - idle standby pods are not part of the cluster yet (fire() skips them)
+            #
+            def _query(zk):
+                replies = fire(zk, self.cluster, 'info')
+                return [(seq, hints['application'], hints.get('task')) for _, (seq, hints, code) in replies.items()
+                        if code == 200 and hints['process'] != 'dead']
+
+            alive = run(self.proxy, _query)
+            assert alive, 'the cluster is either invalid or empty'
+            delta = self.pods - len(alive)
+            if delta > 0:
+
+                #
+                # - we need more pods : first claim idle pods from the standby pool matching the definition of
+                #   the most recent application (if any) and refill it
+                # - then scale that application up for the remainder (the identifiers end with a timestamp, compare
+                #   them without their optional group prefix)
+                # - if all our pods were claimed from a standby pool look that application up in marathon
+                # - the pods that are already running are left untouched
+                # - wait for the new ones to register and settle
+                #
+                marathon = client()
+                applications = set(key for _, key, _ in alive if not pooled(self.cluster, key))
+                if applications:
+                    application = sorted(applications, key=lambda key: key.split('/')[-1])[-1]
+                else:
+                    application = newest(marathon, self.cluster)
+
+                assert application, 'no application to scale up'
+                current = sum(1 for _, key, _ in alive if key == application)
+                reply = marathon.get('/v2/apps/%s' % application)
+                code = reply.status_code
+                assert code == 200, 'application lookup failed (HTTP %d)' % code
+                app = reply.json()['app']
+                digest = app.get('labels', {}).get('ochopod_digest')
+                claimed = []
+                if digest:
+                    standby = pool(self.cluster, digest)
+                    claimed = claim(self.proxy, self.cluster, standby, delta, self.timeout)
+                    refill(self.proxy, marathon, self.cluster, {'id': standby})
+                    delta -= len(claimed)
+
+                js = []
+                if delta:
+                    reply = marathon.put('/v2/apps/%s' % application, js={'instances': app['instances'] + delta})
+                    code = reply.status_code
+                    assert code == 200 or code == 201, 'scaling failed (HTTP %d)' % code
+
+                    target = ['running'] if self.strict else ['stopped', 'running']
+                    js = spin(self.proxy, self.cluster, application, current + delta, target, self.timeout)
+                    assert js, 'timeout while waiting for the new pods'
+
+                known = set(seq for seq, _, _ in alive)
+                self.out['up'] = [seq for _, seq in js if seq not in known] + claimed
+
+            elif delta < 0:
+
+                #
+                # - we have too many pods : gracefully kill the ones with the highest sequence indices
+                # - then remove their marathon tasks while scaling their application(s) down
+                # - the application may have been deleted already if all its pods were phased out
+                #
+                marathon = client()
+                surplus = sorted(alive, reverse=True)[:-delta]
+                down = [seq for seq, _, _ in surplus]
+                js = kill(self.proxy, [self.cluster], subset=down, timeout=self.timeout)[self.cluster]
+                assert js['ok'], 'failed to phase out %d pods' % len(down)
+                self.out['down'] = down
+
+                tasks = [task for _, _, task in surplus if task]
+                if tasks:
+                    reply = marathon.post('/v2/tasks/delete', js={'ids': tasks}, params={'scale': 'true'})
+                    code = reply.status_code
+                    assert code == 200 or code == 404, 'task deletion failed (HTTP %d)' % code
+
+            logger.debug('%s : %d -> %d pods' % (self.cluster, len(alive), self.pods))
+            self.out['ok'] = True
+
+        except AssertionError as failure:
+
+            logger.debug('%s : failed to scale -> %s' % (self.cluster, failure))
+
+        except Exception as failure:
+
+            logger.debug('%s : failed to scale -> %s' % (self.cluster, diagnostic(failure)))
+
+    def join(self, timeout=None):
+
+        Thread.join(self)
+        return self.out
+
+
+def scale(proxy, clusters, pods, timeout=60, strict=False):
+    """
+    Resizes the specified cluster(s) in place using the zookeeper proxy. This is the workflow behind the scale tool
+    and can be invoked in-process (e.g by the portal autoscaler). Returns a dict mapping each cluster to its outcome
+    (e.g 'ok' plus the sequence indices of the pods that were added or phased out).
+    """
+
+    #
+    # - run the workflow proper (one thread per cluster)
+    # - wait for all our threads to join
+    #
+    threads = {cluster: _Automation(
+        proxy,
+        cluster,
+        pods,
+        timeout,
+        strict) for cluster in clusters}
+
+    return {key: thread.join() for key, thread in threads.items()}
+
+
+def go():
+
+    class _Tool(Template):
+
+        help = \
+            '''
+                Resizes the specified cluster(s) in place without re-deploying them. If more pods are needed the most
+                recent marathon application will be scaled up and the tool will wait for the new pods to register
+                (the pods already running are not restarted). Idle pods from a matching standby pool (if any) are
+                turned on first. If less pods are needed the ones with the highest
+                sequence indices will be gracefully phased out and their marathon tasks removed.
+
+                This tool supports optional output in JSON format for 3rd-party integration via the -j switch.
+            '''
+
+        tag = 'scale'
+
+        def customize(self, parser):
+
+            parser.add_argument('clusters', type=str, nargs='+', help='1+ clusters (e.g marathon.foo)')
+            parser.add_argument('-j', action='store_true', dest='json', help='json output')
+            parser.add_argument('-p', action='store', dest='pods', type=int, required=True, help='target number of pods')
+            parser.add_argument('-t', action='store', dest='timeout', type=int, default=60, help='timeout in seconds')
+            parser.add_argument('--strict', action='store_true', dest='strict', help='waits until all pods are running')
+
+        def body(self, args, proxy):
+
+            assert args.pods > 0, 'the target number of pods must be at least 1 (use kill otherwise)'
+
+            n = len(args.clusters)
+            outcome = scale(proxy, args.clusters, args.pods, args.timeout, args.strict)
+            pct = (100 * sum(1 for _, js in outcome.items() if js['ok'])) / n if n else 0
+            up = sum(len(js['up']) for _, js in outcome.items())
+            down = sum(len(js['down']) for _, js in outcome.items())
+            logger.info(json.dumps(outcome) if args.json else '%d%% success (+%d/-%d)' % (pct, up, down))
+            return 0 if pct == 100 else 1
+
+    return _Tool()
@@ -17,8 +17,11 @@
 import fnmatch
 import json
 import logging
+import os
 import pykka
+import re
 import requests
+import struct
 import time
 
 from collections import deque
@@ -28,12 +31,138 @@ from ochopod.core.core import ROOT
 from ochopod.core.fsm import diagnostic, shutdown, spin_lock, Aborted, FSM
 from pykka import Timeout
 from requests.exceptions import Timeout as HTTPTimeout
-from threading import Event, Thread
+from threading import Event, Lock, Thread
 
+#
+# - the queue module got renamed in python 3
+#
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
 
 #: Our ochopod logger.
 logger = logging.getLogger('ochopod')
 
+#: Maximum size in bytes of a single pod reply (larger replies are dropped, see post()).
+MAX_REPLY = int(os.environ.get('OCHOPOD_MAX_REPLY', 4194304))
+
+#: Maximum number of bytes read from all the pods during one single fan-out (see stream()).
+MAX_FANOUT = int(os.environ.get('OCHOPOD_MAX_FANOUT', 67108864))
+
+
+#: Used to pick the sequence index out of the raw zookeeper payload without decoding it.
+_SEQ = re.compile(r'"seq"\s*:\s*(\d+)')
+
+#: Standby pool application identifiers (see toolset.standby.pool()).
+_POOL = re.compile(r'^ochopod\.(.+)-standby-[0-9a-f]{12}$')
+
+
+class Pod(object):
+    """
+    Compact record for a pod registered in zookeeper. The raw JSON payload is kept as is and only decoded upon the
+    first access to one of its hints (the sequence index is extracted right away since it is used to key the pods).
+    The record can be used as a read-only dict (e.g hints['ip']).
+    """
+
+    __slots__ = ('cluster', 'id', 'seq', '_raw', '_hints')
+
+    def __init__(self, cluster, kid, raw):
+
+        self.cluster = cluster
+        self.id = kid
+        self._raw = raw
+        self._hints = None
+
+        #
+        # - the pods always register a top-level "seq" : if it is the only one in the payload we can trust the match
+        # - otherwise (e.g a nested "seq" in the settings) decode the payload to be safe
+        #
+        matched = _SEQ.findall(raw)
+        self.seq = int(matched[0]) if len(matched) == 1 else self.hints['seq']
+
+    @property
+    def key(self):
+        return '%s #%d' % (self.cluster, self.seq)
+
+    @property
+    def payload(self):
+        return self._raw if self._raw is not None else json.dumps({key: value for key, value in self._hints.items() if key not in ('id', 'cluster')})
+
+    @property
+    def hints(self):
+
+        if self._hints is None:
+
+            #
+            # - decode the payload once and drop it
+            # - the pod id & cluster are added as extra hints
+            #
+            hints = \
+                {
+                    'id': self.id,
+                    'cluster': self.cluster
+                }
+
+            hints.update(json.loads(self._raw))
+            self._hints = hints
+            self._raw = None
+
+        return self._hints
+
+    def __getitem__(self, key):
+        return self.hints[key]
+
+    def __contains__(self, key):
+        return key in self.hints
+
+    def __iter__(self):
+        return iter(self.hints)
+
+    def __len__(self):
+        return len(self.hints)
+
+    def get(self, key, default=None):
+        return self.hints.get(key, default)
+
+    def keys(self):
+        return self.hints.keys()
+
+    def items(self):
+        return self.hints.items()
+
+
+def field(js, path):
+    """
+    Walks down a pod reply (e.g from its signal() callback) using a dotted field path (e.g 'stats.load') and returns
+    the value found there. Raises KeyError (or TypeError) if the path does not exist.
+    """
+
+    for token in path.split('.'):
+        js = js[token]
+    return js
+
+
+def matches(cluster, regex):
+    """
+    Returns True if the cluster matches the glob pattern (or any of them if a list of patterns is specified).
+    """
+
+    if isinstance(regex, (list, tuple)):
+        return any(fnmatch.fnmatch(cluster, pattern) for pattern in regex)
+    return fnmatch.fnmatch(cluster, regex)
+
+
+def split(js, patterns):
+    """
+    Splits a dict keyed by pod (e.g as returned by lookup() or fire()) per glob pattern. This is used by the tools to
+    display per pattern the results of a single fan-out. A pod matching more than one pattern is reported under each
+    of them. Returns a list of (pattern, dict) tuples in the specified order.
+    """
+
+    return [(pattern, {key: value for key, value in js.items() if fnmatch.fnmatch(key.split(' #')[0], pattern)})
+            for pattern in patterns]
+
 
 def lookup(zk, regex, subset=None):
 
@@ -43,26 +172,22 @@ def lookup(zk, regex, subset=None):
         #
         # - use a glob style regex to match the cluster (handy to retrieve multiple
         #   clusters at once)
+        # - a list of patterns can be specified as well (each pod is then returned once)
         #
-        clusters = [cluster for cluster in zk.get_children(ROOT) if fnmatch.fnmatch(cluster, regex)]
+        clusters = [cluster for cluster in zk.get_children(ROOT) if matches(cluster, regex)]
         for cluster in clusters:
             kids = zk.get_children('%s/%s/pods' % (ROOT, cluster))
             for kid in kids:
-                js, _ = zk.get('%s/%s/pods/%s' % (ROOT, cluster, kid))
-                hints = \
-                    {
-                        'id': kid,
-                        'cluster': cluster
-                    }
 
                 #
                 # - the number displayed by the tools (e.g shared.docker-proxy #4) is that monotonic integer
                 #   derived from zookeeper
+                # - the payload itself is decoded lazily
                 #
-                hints.update(json.loads(js))
-                seq = hints['seq']
-                if not subset or seq in subset:
-                    pods['%s #%d' % (cluster, seq)] = hints
+                js, _ = zk.get('%s/%s/pods/%s' % (ROOT, cluster, kid))
+                pod = Pod(cluster, kid, js)
+                if not subset or pod.seq in subset:
+                    pods[pod.key] = pod
 
     except NoNodeError:
         pass
@@ -72,57 +197,253 @@ def lookup(zk, regex, subset=None):
     return pods
 
 
-def fire(zk, cluster, command, subset=None, timeout=10.0, js=None):
+#: Header for the registry snapshots (magic + format version).
+_MAGIC = 'OCHO\x01'
 
-    class _Post(Thread):
-        """
-        We optimize a bit the HTTP queries to the pods by running them on separate threads (this can be a
-        tad slow otherwise for more than 10 queries in a row)
-        """
 
-        def __init__(self, key, hints):
-            super(_Post, self).__init__()
+def dump(path, pods):
+    """
+    Persists the specified pods (as returned by lookup()) to disk using a compact length-prefixed binary format. The
+    file is written atomically (e.g readers will never see a partial snapshot).
+    """
 
-            self.key = key
-            self.hints = hints
-            self.body = None
-            self.code = None
+    tmp = '%s.tmp' % path
+    with open(tmp, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(struct.pack('>I', len(pods)))
+        for pod in pods.values():
+            payload = pod.payload
+            f.write(struct.pack('>HHI', len(pod.cluster), len(pod.id), len(payload)))
+            f.write(pod.cluster)
+            f.write(pod.id)
+            f.write(payload)
 
-            self.start()
+    os.rename(tmp, path)
 
-        def run(self):
 
-            url = 'N/A'
-            try:
-                ts = time.time()
-                port = self.hints['port']
-                assert port in self.hints['ports'], 'ochopod control port not exposed @ %s (user error ?)' % self.key
-                url = 'http://%s:%d/%s' % (self.hints['ip'], self.hints['ports'][port], command)
-                reply = requests.post(url, timeout=timeout, data=js)
-                self.body = reply.json()
-                self.code = reply.status_code
-                ms = 1000 * (time.time() - ts)
-                logger.debug('-> %s (HTTP %d, %s ms)' % (url, reply.status_code, int(ms)))
-
-            except HTTPTimeout:
-                logger.debug('-> %s (timeout)' % url)
+def load(path, regex='*', subset=None):
+    """
+    Reads a registry snapshot written by dump() and returns the pods whose cluster matches the glob pattern (keyed
+    the same way lookup() does).
+    """
 
-            except Exception as failure:
-                logger.debug('-> %s (i/o error, %s)' % (url, failure))
+    pods = {}
+    with open(path, 'rb') as f:
+        buf = f.read()
+
+    assert buf.startswith(_MAGIC), 'invalid registry snapshot @ %s' % path
+    offset = len(_MAGIC)
+    n, = struct.unpack_from('>I', buf, offset)
+    offset += 4
+    for _ in range(n):
+        a, b, c = struct.unpack_from('>HHI', buf, offset)
+        offset += 8
+        cluster = buf[offset:offset + a]
+        offset += a
+        if matches(cluster, regex):
+            pod = Pod(cluster, buf[offset:offset + b], buf[offset + b:offset + b + c])
+            if not subset or pod.seq in subset:
+                pods[pod.key] = pod
+
+        offset += b + c
+
+    return pods
+
+
+def pooled(cluster, application):
+    """
+    Returns True if the marathon application is a standby pool of the specified cluster (as opposed to one of its
+    regular timestamped applications).
+    """
+
+    matched = _POOL.match(application.split('/')[-1])
+    return matched is not None and matched.group(1) == cluster
+
+
+def members(zk, regex, subset=None, timeout=10.0):
+    """
+    Same as lookup() minus the idle pods sitting in a standby pool : these register under their cluster but are not
+    part of it until they are claimed (e.g turned on). Only the pods belonging to a pool are queried to find out.
+    """
+
+    pods = lookup(zk, regex, subset=subset)
+    standby = {key: pod for key, pod in pods.items() if '-standby-' in pod.payload and pooled(pod.cluster, pod['application'])}
+    if standby:
+        for key, _, hints, code in stream(standby, 'info', timeout=timeout):
+            if code == 200 and hints['process'] == 'stopped':
+                del pods[key]
+
+    return pods
+
+
+def peek(zk, regex, subset=None):
+    """
+    Registry lookup used by the tools which do not need to contact the pods. The on-disk snapshot maintained by the
+    portal is used if available (e.g $OCHOPOD_SNAPSHOT, which the portal only sets until it reconciled its registry
+    with zookeeper), otherwise we'll default to a regular zookeeper lookup.
+    """
+
+    path = os.environ.get('OCHOPOD_SNAPSHOT')
+    if path and os.path.exists(path):
+        try:
+            ts = time.time()
+            pods = load(path, regex, subset=subset)
+            ms = 1000 * (time.time() - ts)
+            logger.debug('<- snapshot (%d pods, %d ms)' % (len(pods), int(ms)))
+            return pods
+
+        except Exception as failure:
+
+            logger.debug('<- snapshot (i/o error, %s)' % failure)
+
+    return lookup(zk, regex, subset=subset)
+
+
+def watch(zk, cluster, latch, stop):
+    """
+    Sets the latch (e.g a threading Event) whenever pods register or unregister for the specified cluster. The
+    zookeeper watch is dropped upon the first notification following stop being set. If the cluster does not exist
+    yet in zookeeper (e.g first deployment) we wait for it to be created first.
+    """
+
+    path = '%s/%s/pods' % (ROOT, cluster)
+
+    def _on_change(_):
+
+        if stop.is_set():
+            return False
+
+        latch.set()
+
+    def _on_data(_, stat):
+
+        #
+        # - the node got created (e.g the first pod is registering) : switch to a children watch
+        # - please note a data watch is invoked once right away (it will see the node if it got created meanwhile)
+        #
+        if stop.is_set():
+            return False
+
+        if stat is not None:
+            zk.ChildrenWatch(path, _on_change)
+            return False
+
+    if zk.exists(path):
+        zk.ChildrenWatch(path, _on_change)
+    else:
+        zk.DataWatch(path, _on_data)
+
+
+class _Budget():
+    """
+    Byte budget shared by the threads of a fan-out. Once exhausted any further read is denied.
+    """
+
+    def __init__(self, total):
+
+        self.left = total
+        self.lock = Lock()
+
+    def take(self, n):
+
+        with self.lock:
+            if n > self.left:
+                self.left = 0
+                return False
+
+            self.left -= n
+            return True
+
+
+def post(pod, command, timeout=10.0, js=None, limit=MAX_REPLY, budget=None):
+    """
+    HTTP POST against the control port of a single pod (as returned by lookup()). Returns the decoded reply plus the
+    HTTP code, or (None, None) upon failure. The reply is read incrementally : if it goes over the limit (or over the
+    optional shared budget) we stop reading and return a {'truncated': True, 'bytes': ...} marker plus HTTP 413.
+    """
+
+    url = 'N/A'
+    try:
+        ts = time.time()
+        port = pod['port']
+        assert port in pod['ports'], 'ochopod control port not exposed @ %s (user error ?)' % pod.key
+        url = 'http://%s:%d/%s' % (pod['ip'], pod['ports'][port], command)
+        reply = requests.post(url, timeout=timeout, data=js, stream=True)
+        try:
+
+            #
+            # - bail out right away if the advertised length is already over the limit
+            # - otherwise read chunk after chunk and charge each one against our budget
+            #
+            size = int(reply.headers.get('content-length', 0))
+            chunks = []
+            if size <= limit:
+                size = 0
+                for chunk in reply.iter_content(chunk_size=65536):
+                    size += len(chunk)
+                    if size > limit or (budget and not budget.take(len(chunk))):
+                        break
+                    chunks.append(chunk)
+                else:
+                    body = json.loads(b''.join(chunks).decode('utf-8'))
+                    ms = 1000 * (time.time() - ts)
+                    logger.debug('-> %s (HTTP %d, %s ms)' % (url, reply.status_code, int(ms)))
+                    return body, reply.status_code
+
+            logger.debug('-> %s (reply truncated after %d bytes)' % (url, size))
+            return {'truncated': True, 'bytes': size}, 413
+
+        finally:
+            reply.close()
+
+    except HTTPTimeout:
+        logger.debug('-> %s (timeout)' % url)
+
+    except Exception as failure:
+        logger.debug('-> %s (i/o error, %s)' % (url, failure))
+
+    return None, None
+
+
+def stream(pods, command, timeout=10.0, js=None, limit=MAX_REPLY, total=MAX_FANOUT):
+    """
+    Fans a HTTP POST out to the specified pods (as returned by lookup()) and yields (key, pod, body, code) tuples as
+    the replies come back (e.g in completion order). The payload can be a callable in which case it is invoked with
+    each pod key (e.g per-pod payloads). Each reply is capped to limit bytes and all of them to total bytes (see
+    post()).
+    """
+
+    #
+    # - we optimize a bit the HTTP queries to the pods by running them on separate threads (this can be a
+    #   tad slow otherwise for more than 10 queries in a row)
+    # - each thread pushes its outcome to a queue which we drain as we go
+    #
+    replies = Queue()
+    budget = _Budget(total)
+
+    def _post(key, pod):
+        body, code = post(pod, command, timeout=timeout, js=js(key) if callable(js) else js, limit=limit, budget=budget)
+        replies.put((key, pod, body, code))
+
+    for key, pod in pods.items():
+        thread = Thread(target=_post, args=(key, pod))
+        thread.daemon = True
+        thread.start()
+
+    for _ in range(len(pods)):
+        yield replies.get()
 
-        def join(self, timeout=None):
 
-            Thread.join(self)
-            return self.key, self.hints['seq'], self.body, self.code
+def fire(zk, cluster, command, subset=None, timeout=10.0, js=None, limit=MAX_REPLY, total=MAX_FANOUT, standby=False):
 
     #
-    # - lookup our pods based on the cluster(s) we want
-    # - fire a thread for each
+    # - lookup our pods based on the cluster(s) we want (idle standby pods are skipped unless specified otherwise)
+    # - fire a HTTP POST to each and wait for all the replies
+    # - the pods that did not reply or whose reply was truncated (HTTP 413) are left out
     #
-    pods = lookup(zk, cluster, subset=subset)
-    threads = [_Post(pod, hints) for pod, hints in pods.items()]
-    out = [thread.join() for thread in threads]
-    return {key: (seq, body, code) for (key, seq, body, code) in out if code}
+    pods = lookup(zk, cluster, subset=subset) if standby else members(zk, cluster, subset=subset, timeout=timeout)
+    replies = stream(pods, command, timeout=timeout, js=js, limit=limit, total=total)
+    return {key: (pod.seq, body, code) for key, pod, body, code in replies if code and code != 413}
 
 
 def run(proxy, func, timeout=60.0):
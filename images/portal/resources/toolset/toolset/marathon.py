@@ -0,0 +1,284 @@
+#
+# Copyright (c) 2015 Autodesk Inc.
+# All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import logging
+import os
+import random
+import requests
+import time
+
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+from threading import Lock, Thread
+
+#: Our ochopod logger.
+logger = logging.getLogger('ochopod')
+
+#: Shared client instance (see client()).
+_client = None
+
+#: Shared event bus listener (see listener()).
+_listener = None
+
+#: Guards the creation of the shared client & listener.
+_lock = Lock()
+
+#: Methods which can safely be sent twice.
+_IDEMPOTENT = set(['DELETE', 'GET', 'HEAD', 'OPTIONS', 'PUT'])
+
+
+def _unsent(failure):
+
+    #
+    # - connect timeouts or connections that could not be established mean the request never went out
+    # - anything else (read timeout, connection reset, etc.) may happen after marathon processed it
+    #
+    if isinstance(failure, ConnectTimeout):
+        return True
+
+    reason = getattr(failure.args[0], 'reason', None) if failure.args else None
+    return isinstance(failure, ConnectionError) and type(reason).__name__ == 'NewConnectionError'
+
+
+class Marathon():
+    """
+    Small marathon REST client shared by the tools. All the requests go through one pooled session and are sent to
+    the current marathon leader (discovered via /v2/leader) in order to avoid having a non-leader master proxy them.
+    We fail over to the other masters upon connection errors and cap the request rate on our end.
+    """
+
+    def __init__(self, masters, leader=None, rate=20.0, pool=16, timeout=10.0):
+
+        self.allowance = rate
+        self.last = time.time()
+        self.leader = leader
+        self.lock = Lock()
+        self.masters = masters
+        self.rate = rate
+        self.timeout = timeout
+
+        adapter = HTTPAdapter(pool_connections=len(masters) + 1, pool_maxsize=pool)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.headers.update(
+            {
+                'content-type': 'application/json',
+                'accept': 'application/json'
+            })
+
+    def _throttle(self):
+
+        #
+        # - simple token bucket refilled at self.rate requests per second
+        # - block until we have at least one token
+        #
+        while 1:
+            with self.lock:
+                now = time.time()
+                self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+                self.last = now
+                if self.allowance >= 1.0:
+                    self.allowance -= 1.0
+                    return
+
+                wait = (1.0 - self.allowance) / self.rate
+
+            time.sleep(wait)
+
+    def discover(self):
+        """
+        Queries the masters (in random order) until one of them tells us who the current leader is.
+        """
+
+        for master in random.sample(self.masters, len(self.masters)):
+            try:
+                self._throttle()
+                reply = self.session.get('http://%s/v2/leader' % master, timeout=self.timeout)
+                if reply.status_code == 200:
+                    self.leader = reply.json()['leader']
+                    logger.debug('-> marathon leader @ %s' % self.leader)
+                    return self.leader
+
+            except (ConnectionError, Timeout, ValueError, KeyError):
+                pass
+
+        self.leader = None
+        return None
+
+    def request(self, method, path, js=None, **kwargs):
+        """
+        Issues a REST request against the marathon leader (discovering it first if needed) and fails over to the
+        other masters if the leader cannot be reached or is not ready (HTTP 503, e.g during an election). Requests
+        that are not idempotent (e.g POST) only fail over if they could not be sent at all.
+        """
+
+        if not self.leader:
+            self.discover()
+
+        if js is not None:
+            kwargs['data'] = json.dumps(js)
+
+        kwargs.setdefault('timeout', self.timeout)
+        candidates = [self.leader] if self.leader else []
+        candidates += [master for master in random.sample(self.masters, len(self.masters)) if master != self.leader]
+        last = None
+        for master in candidates:
+            url = 'http://%s%s' % (master, path)
+            try:
+
+                self._throttle()
+                reply = self.session.request(method, url, **kwargs)
+                logger.debug('-> %s %s (HTTP %d)' % (method, url, reply.status_code))
+                if reply.status_code != 503:
+                    return reply
+
+                last = 'HTTP 503'
+
+            except (ConnectionError, Timeout) as failure:
+
+                logger.debug('-> %s %s (i/o error, %s)' % (method, url, failure))
+                last = failure
+                if method.upper() not in _IDEMPOTENT and not _unsent(failure):
+
+                    #
+                    # - the leader may have processed it already : sending it again could create duplicates
+                    #
+                    self.leader = None
+                    assert 0, 'marathon request outcome unknown (%s)' % failure
+
+            #
+            # - the leader may have changed, look it up again next time
+            #
+            self.leader = None
+
+        assert 0, 'marathon unreachable (%s)' % last
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, js=None, **kwargs):
+        return self.request('POST', path, js=js, **kwargs)
+
+    def put(self, path, js=None, **kwargs):
+        return self.request('PUT', path, js=js, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def events(self):
+        """
+        Generator streaming the marathon event bus (server-sent events over /v2/events) and yielding each event as a
+        dict. This will block until the next event is received.
+        """
+
+        reply = self.get('/v2/events', stream=True, headers={'accept': 'text/event-stream'}, timeout=(self.timeout, None))
+        assert reply.status_code == 200, 'unable to subscribe to the event bus (HTTP %d)' % reply.status_code
+        try:
+            for line in reply.iter_lines(chunk_size=1):
+                if line and line.startswith('data:'):
+                    try:
+                        yield json.loads(line[5:])
+
+                    except ValueError:
+                        pass
+
+        finally:
+            reply.close()
+
+
+class Listener(Thread):
+    """
+    Background thread subscribing to the marathon event bus and dispatching each event to the callbacks currently
+    registered. One listener is shared by all the threads of a given process (see listener()).
+    """
+
+    def __init__(self, marathon):
+        super(Listener, self).__init__()
+
+        self.callbacks = set()
+        self.daemon = True
+        self.lock = Lock()
+        self.marathon = marathon
+
+        self.start()
+
+    def run(self):
+
+        while 1:
+            try:
+                for event in self.marathon.events():
+                    with self.lock:
+                        callbacks = list(self.callbacks)
+
+                    for callback in callbacks:
+                        callback(event)
+
+            except Exception as failure:
+
+                logger.debug('-> marathon event bus (i/o error, %s)' % failure)
+
+            #
+            # - the stream was interrupted, re-subscribe after a short pause
+            #
+            time.sleep(1.0)
+
+    def subscribe(self, callback):
+
+        with self.lock:
+            self.callbacks.add(callback)
+
+    def unsubscribe(self, callback):
+
+        with self.lock:
+            self.callbacks.discard(callback)
+
+
+def client():
+    """
+    Returns the marathon client shared by all the threads of the current process. The masters are passed down via
+    $MARATHON_MASTER. The portal may also pass the leader it last looked up (it refreshes it periodically) via
+    $MARATHON_LEADER.
+    """
+
+    global _client
+    with _lock:
+        if _client is None:
+
+            #
+            # - we need to pass the framework master IPs around (ugly)
+            #
+            assert 'MARATHON_MASTER' in os.environ, '$MARATHON_MASTER not specified (check your portal pod)'
+            masters = os.environ['MARATHON_MASTER'].split(',')
+            rate = float(os.environ.get('MARATHON_RATE', 20))
+            _client = Marathon(masters, leader=os.environ.get('MARATHON_LEADER'), rate=rate)
+
+        return _client
+
+
+def listener():
+    """
+    Returns the marathon event bus listener shared by all the threads of the current process (the subscription is
+    only made upon the first call).
+    """
+
+    global _listener
+    marathon = client()
+    with _lock:
+        if _listener is None:
+            _listener = Listener(marathon)
+
+        return _listener
@@ -0,0 +1,90 @@
+#
+# Copyright (c) 2015 Autodesk Inc.
+# All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import logging
+import time
+
+from threading import Event
+from toolset.io import fire, lookup, run, watch
+from toolset.marathon import listener
+
+#: Our ochopod logger.
+logger = logging.getLogger('ochopod')
+
+
+def spin(proxy, cluster, application, pods, target, timeout):
+    """
+    Waits until the specified number of pods belonging to the marathon application registered in zookeeper and
+    reported a process state matching the target list (e.g ['dead', 'running']). We are notified of any change via a
+    zookeeper watch on the cluster pods as well as via the marathon event bus. The pods themselves are only queried
+    once they registered and until they settle. Returns a list of (state, seq) tuples (empty upon timeout).
+    """
+
+    latch = Event()
+    stop = Event()
+    settled = {}
+
+    def _on_event(event):
+
+        #
+        # - any event related to our application (task status update, deployment step, etc.) wakes us up
+        #
+        if event.get('appId', '').lstrip('/') == application:
+            latch.set()
+
+    bus = listener()
+    bus.subscribe(_on_event)
+    run(proxy, lambda zk: watch(zk, cluster, latch, stop))
+    try:
+
+        ts = time.time()
+        while 1:
+
+            latch.clear()
+
+            def _query(zk):
+
+                #
+                # - lookup the pods registered for our application (zookeeper only)
+                # - only contact the ones that did not settle yet
+                #
+                registered = [pod.seq for pod in lookup(zk, cluster).values() if pod['application'] == application]
+                pending = [seq for seq in registered if seq not in settled]
+                replies = fire(zk, cluster, 'info', subset=pending) if pending else {}
+                return len(pending), [(seq, hints['process']) for seq, hints, code in replies.values() if code == 200 and hints['process'] in target]
+
+            pending, js = run(proxy, _query)
+            settled.update(js)
+            if len(settled) >= pods:
+                ms = 1000 * (time.time() - ts)
+                logger.debug('%s : %d pods settled (%d ms)' % (application, len(settled), int(ms)))
+                return [(state, seq) for seq, state in settled.items()]
+
+            left = timeout - (time.time() - ts)
+            if left <= 0:
+                logger.debug('%s : timeout (%d/%d pods settled)' % (application, len(settled), pods))
+                return []
+
+            #
+            # - if some of our pods registered but did not settle yet poll them again shortly
+            # - otherwise wait for a zookeeper/marathon notification (with a safety net in case we missed one)
+            #
+            latch.wait(min(left, 1.0 if pending > len(js) else 10.0))
+
+    finally:
+
+        stop.set()
+        bus.unsubscribe(_on_event)
@@ -0,0 +1,106 @@
+#
+# Copyright (c) 2015 Autodesk Inc.
+# All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import logging
+import os
+import time
+
+from kazoo.client import KazooClient
+from ochopod.core.fsm import diagnostic
+from threading import Event, Thread
+from toolset.io import dump, load, lookup
+
+#: Our ochopod logger.
+logger = logging.getLogger('ochopod')
+
+
+class Registry(Thread):
+    """
+    Background thread run by the portal and periodically persisting the whole pod registry to disk (see dump()). Any
+    existing snapshot is served right away upon boot and reconciled against zookeeper in the background : the
+    registry is flagged as stale until then (or whenever zookeeper cannot be reached).
+    """
+
+    def __init__(self, brokers, path, period=30.0):
+        super(Registry, self).__init__()
+
+        self.brokers = brokers
+        self.daemon = True
+        self.path = path
+        self.pods = 0
+        self.period = period
+        self.reconciled = Event()
+        self.stale = True
+        self.stopped = Event()
+
+        if os.path.exists(path):
+            try:
+
+                #
+                # - make sure the snapshot we inherited is readable
+                # - the tools will pick it up via $OCHOPOD_SNAPSHOT
+                #
+                self.pods = len(load(path))
+                logger.info('registry : serving %d pods from %s (stale)' % (self.pods, path))
+
+            except Exception as failure:
+
+                logger.warning('registry : discarding %s (%s)' % (path, diagnostic(failure)))
+                os.remove(path)
+
+        self.start()
+
+    def run(self):
+
+        zk = None
+        while not self.stopped.is_set():
+            try:
+
+                if zk is None:
+                    zk = KazooClient(hosts=','.join(self.brokers), timeout=30.0, read_only=1, randomize_hosts=1)
+                    zk.start()
+
+                #
+                # - full scan of the registry
+                # - persist it to disk and clear the stale flag
+                #
+                ts = time.time()
+                pods = lookup(zk, '*')
+                dump(self.path, pods)
+                ms = 1000 * (time.time() - ts)
+                logger.debug('registry : %d pods persisted to %s (%d ms)' % (len(pods), self.path, int(ms)))
+                self.pods = len(pods)
+                self.stale = False
+                self.reconciled.set()
+
+            except Exception as failure:
+
+                #
+                # - zookeeper is not reachable (or something went wrong with the disk)
+                # - keep serving the last snapshot we have but flag it as stale
+                #
+                logger.warning('registry : reconciliation failed (%s)' % diagnostic(failure))
+                self.stale = True
+                if zk is not None:
+                    zk.stop()
+                    zk.close()
+                    zk = None
+
+            self.stopped.wait(self.period)
+
+        if zk is not None:
+            zk.stop()
+            zk.close()
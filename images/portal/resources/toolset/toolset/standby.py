@@ -0,0 +1,188 @@
+#
+# Copyright (c) 2015 Autodesk Inc.
+# All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import logging
+import re
+
+from toolset.io import fire, pooled, run
+
+#: Our ochopod logger.
+logger = logging.getLogger('ochopod')
+
+
+def pool(qualified, digest):
+    """
+    Returns the marathon application identifier used to host the standby pods for a given cluster and definition
+    digest. Including the digest guarantees we never claim pods booted off a different definition.
+    """
+
+    return 'ochopod.%s-standby-%s' % (qualified, digest[:12])
+
+
+def claim(proxy, cluster, application, n, timeout=10.0):
+    """
+    Turns on up to n idle pods from the specified standby application (lowest sequence indices first) and returns the
+    sequence indices of the ones that acknowledged.
+    """
+
+    def _query(zk):
+        replies = fire(zk, cluster, 'info', standby=True)
+        return sorted(seq for seq, hints, code in replies.values()
+                      if code == 200 and hints['application'] == application and hints['process'] == 'stopped')
+
+    seqs = run(proxy, _query)[:n]
+    if not seqs:
+        return []
+
+    def _on(zk):
+        replies = fire(zk, cluster, 'control/on', subset=seqs, timeout=timeout, standby=True)
+        return sorted(seq for seq, _, code in replies.values() if code == 200)
+
+    claimed = run(proxy, _on)
+    logger.debug('%s : claimed %d/%d standby pods' % (application, len(claimed), len(seqs)))
+    return claimed
+
+
+def refill(proxy, marathon, cluster, spec, size=None):
+    """
+    Makes sure the standby application defined by spec offers size idle pods on top of the ones that were claimed and
+    are still in use (the size defaults to the 'ochopod_standby' label of the pool). Claimed pods that have been phased
+    out since and idle pods in excess are removed along with their marathon task. The application is created if
+    needed. Marathon will schedule the new pods in the background (e.g we do not wait for them).
+    """
+
+    reply = marathon.get('/v2/apps/%s' % spec['id'])
+    code = reply.status_code
+    assert code == 200 or code == 404, 'standby lookup failed (HTTP %d)' % code
+    if code == 404:
+        if size:
+            reply = marathon.post('/v2/apps', js=dict(spec, instances=size))
+            code = reply.status_code
+            assert code == 200 or code == 201, 'standby submission failed (HTTP %d)' % code
+        return
+
+    app = reply.json()['app']
+    if size is None:
+        size = int(app.get('labels', {}).get('ochopod_standby', 0))
+
+    #
+    # - count the pods claimed from the pool that are still part of the cluster
+    # - the dead ones are kept around by marathon and the idle ones may be in excess
+    #
+    def _query(zk):
+        replies = fire(zk, cluster, 'info', standby=True)
+        js = sorted((seq, hints) for seq, hints, code in replies.values()
+                    if code == 200 and hints['application'] == spec['id'])
+        return sum(1 for _, hints in js if hints['process'] not in ('dead', 'stopped')), \
+            [hints['task'] for _, hints in js if hints['process'] == 'dead' and hints.get('task')], \
+            [hints['task'] for _, hints in js if hints['process'] == 'stopped' and hints.get('task')]
+
+    busy, dead, idle = run(proxy, _query)
+
+    #
+    # - we pick the tasks to remove ourselves (dead pods plus the idle pods in excess, highest sequence indices first)
+    #   and scale the pool down accordingly : marathon would otherwise pick them and may hit pods that are in use
+    # - the pods still booting are accounted for as idle ones
+    #
+    instances = app['instances']
+    surplus = min(len(idle), max(0, instances - len(dead) - busy - size))
+    tasks = dead + (idle[-surplus:] if surplus else [])
+    if tasks:
+        reply = marathon.post('/v2/tasks/delete', js={'ids': tasks}, params={'scale': 'true'})
+        code = reply.status_code
+        assert code == 200 or code == 404, 'standby task deletion failed (HTTP %d)' % code
+        instances -= len(tasks)
+
+    #
+    # - scale the pool up if needed
+    # - force the update as the pool may still be locked by the task deletion or by a previous refill
+    #
+    if instances < busy + size:
+        reply = marathon.put('/v2/apps/%s' % spec['id'], js={'instances': busy + size}, params={'force': 'true'})
+        code = reply.status_code
+        assert code == 200 or code == 201, 'standby refill failed (HTTP %d)' % code
+
+
+def retire(proxy, marathon, cluster, keep=None):
+    """
+    Deletes the standby applications of a cluster that do not match the current definition (e.g any pool other than
+    keep), provided none of their pods were claimed and are still running. Returns the deleted application identifiers.
+    """
+
+    reply = marathon.get('/v2/apps', params={'id': 'ochopod.%s-standby-' % cluster})
+    code = reply.status_code
+    assert code == 200, 'standby lookup failed (HTTP %d)' % code
+    pools = [js['id'].lstrip('/') for js in reply.json()['apps'] if pooled(cluster, js['id'])]
+    stale = [application for application in pools if application != keep]
+    if not stale:
+        return []
+
+    def _query(zk):
+        replies = fire(zk, cluster, 'info', standby=True)
+        return set(hints['application'] for _, hints, code in replies.values()
+                   if code == 200 and hints['process'] not in ('dead', 'stopped'))
+
+    busy = run(proxy, _query)
+    retired = []
+    for application in stale:
+        if application not in busy:
+            reply = marathon.delete('/v2/apps/%s' % application)
+            if reply.status_code in (200, 204):
+                retired.append(application)
+
+    logger.debug('%s : retired %d stale standby pools' % (cluster, len(retired)))
+    return retired
+
+
+def _generations(marathon, cluster):
+
+    #
+    # - list the regular marathon applications of the cluster (e.g timestamped, see deploy)
+    # - the id filter is a plain substring match : make sure we do not pick other clusters up
+    #
+    reply = marathon.get('/v2/apps', params={'id': 'ochopod.%s-' % cluster})
+    code = reply.status_code
+    assert code == 200, 'application lookup failed (HTTP %d)' % code
+    regex = re.compile(r'^ochopod\.%s-\d{4}(-\d{2}){5}$' % re.escape(cluster))
+    return [js for js in reply.json()['apps'] if regex.match(js['id'].split('/')[-1])]
+
+
+def newest(marathon, cluster):
+    """
+    Returns the identifier of the most recent regular marathon application of a cluster, or None. This is how we find
+    it when all the pods of the cluster were claimed from a standby pool (its application then runs no pod).
+    """
+
+    found = [js['id'].lstrip('/') for js in _generations(marathon, cluster)]
+    return max(found, key=lambda key: key.split('/')[-1]) if found else None
+
+
+def prune(marathon, cluster, keep):
+    """
+    Deletes the regular marathon applications of a cluster that run no pod (other than keep). Those are left behind by
+    deployments whose pods were all claimed from a standby pool. Returns the deleted application identifiers.
+    """
+
+    empty = [js['id'].lstrip('/') for js in _generations(marathon, cluster) if not js['instances']]
+    pruned = []
+    for application in empty:
+        if application != keep:
+            reply = marathon.delete('/v2/apps/%s' % application)
+            if reply.status_code in (200, 204):
+                pruned.append(application)
+
+    logger.debug('%s : pruned %d empty applications' % (cluster, len(pruned)))
+    return pruned